@@ -82,4 +82,7 @@ echo "----------- Copying Functions -----------"
 psql $PROD_DB_CONNECT_STRING -A -t -c "SELECT pg_get_functiondef(oid) || ';' FROM pg_proc where proname like '%score%'" | \
   psql $LOCAL_DB_CONNECT_STRING
 echo "-------------- Data Copied --------------"
+echo "------- Creating the App's Tables -------"
+# after the data so data_versions starts from the copied check-ins
+./migrate $LOCAL_DB_CONNECT_STRING ./sql
 echo "------- Finished Database Seeding -------"
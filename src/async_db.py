@@ -0,0 +1,35 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Queries the bot runs at once. Each thread opens its own connection, so
+# this also caps the bot's connections; the rest wait their turn in the
+# executor queue without holding up the event loop.
+DB_THREADS = int(os.environ.get("BOT_DB_THREADS", 4))
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=DB_THREADS, thread_name_prefix="bot-db"
+            )
+        return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """
+    Awaits blocking fn(*args, **kwargs) (queries, cache and roster lookups)
+    on the bot's database threads so the event loop keeps serving
+    interactions and heartbeats meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor(), functools.partial(fn, *args, **kwargs)
+    )
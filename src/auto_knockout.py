@@ -1,6 +1,8 @@
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime, time, timedelta
 import logging
+from types import SimpleNamespace
 from zoneinfo import ZoneInfo
 
 
@@ -123,7 +125,8 @@ def mulligan_time_for(challenger_tz, missing_date):
     return datetime.combine(missing_date, time(hour=12), tzinfo=ZoneInfo(challenger_tz))
 
 
-def get_previous_challenge_week(cur):
+def get_previous_challenge_weeks(cur):
+    """Every week that ended yesterday, one per challenge."""
     cur.execute(
         """
         select
@@ -138,14 +141,14 @@ def get_previous_challenge_week(cur):
         where cw."end" = (
             (current_timestamp at time zone 'America/New_York')::date - interval '1 day'
         )::date
-        order by cw."end" desc
-        limit 1;
+        order by cw."end" desc, c.id;
         """
     )
-    return cur.fetchone()
+    return cur.fetchall()
 
 
-def get_current_challenge_week(cur):
+def get_current_challenge_weeks(cur):
+    """The running week of every active challenge."""
     cur.execute(
         """
         select
@@ -162,17 +165,22 @@ def get_current_challenge_week(cur):
             and (current_timestamp at time zone 'America/New_York')::date <= cw."end"
             and (current_timestamp at time zone 'America/New_York')::date >= c.start
             and (current_timestamp at time zone 'America/New_York')::date <= c."end"
-        order by cw.start desc
-        limit 1;
+        order by cw.start desc, c.id;
         """
     )
-    return cur.fetchone()
+    return cur.fetchall()
 
 
-def get_participants_for_week(cur, challenge_id, challenge_week_id, run_day):
+def get_participants_for_weeks(cur, weeks, run_day):
+    """Every active participant of every week in one query, by week then name."""
     cur.execute(
         """
+        with weeks as (
+            select *
+            from unnest(%s::bigint[], %s::bigint[]) as w(challenge_id, challenge_week_id)
+        )
         select
+            w.challenge_week_id,
             ch.id,
             ch.name,
             ch.discord_id,
@@ -191,24 +199,29 @@ def get_participants_for_week(cur, challenge_id, challenge_week_id, run_day):
                 bool_or(c.tier != 'T0' and c.day_of_week = %s),
                 false
             ) as current_day_checked_in
-        from challenger_challenges cc
+        from weeks w
+        join challenger_challenges cc on cc.challenge_id = w.challenge_id
         join challengers ch on ch.id = cc.challenger_id
         left join checkins c on
             c.challenger = ch.id
-            and c.challenge_week_id = %s
+            and c.challenge_week_id = w.challenge_week_id
         where
-            cc.challenge_id = %s
-            and cc.knocked_out = false
+            cc.knocked_out = false
             and coalesce(cc.tier, '') != 'T0'
         group by
+            w.challenge_week_id,
             ch.id,
             ch.name,
             ch.discord_id,
             ch.tz,
             cc.mulligan
-        order by ch.name;
+        order by w.challenge_week_id, ch.name;
         """,
-        (run_day, challenge_week_id, challenge_id),
+        (
+            [w.challenge_id for w in weeks],
+            [w.challenge_week_id for w in weeks],
+            run_day,
+        ),
     )
     return cur.fetchall()
 
@@ -262,82 +275,153 @@ def get_alert_participants_for_week(cur, challenge_id, challenge_week_id, run_da
     return cur.fetchall()
 
 
-def insert_mulligan(cur, participant, challenge_week):
-    day_name, missing_date = first_missed_day(
-        challenge_week.start,
-        participant.checked_in_days,
-    )
-    if day_name is None:
-        logging.warning("No missing mulligan day found for %s", participant.name)
-        return None, None
-
-    mulligan_time = mulligan_time_for(participant.tz, missing_date)
+def insert_mulligans(cur, mulligans):
+    """
+    Inserts the mulligan check-ins and points each challenger's mulligan at
+    theirs, all in one statement. mulligans are (participant, challenge_week,
+    day_name, missing_date); returns {(challenger_id, challenge_week_id): checkin id}.
+    """
+    if not mulligans:
+        return {}
     cur.execute(
         """
-        insert into checkins
-            (name, time, tier, day_of_week, text, challenge_week_id, challenger, tz)
-        values
-            (%s, %s, 'T1', %s, 'MULLIGAN T1 checkin', %s, %s, %s)
-        returning id;
+        with m as (
+            select *
+            from unnest(
+                %s::text[], %s::timestamptz[], %s::text[], %s::bigint[],
+                %s::bigint[], %s::text[], %s::bigint[]
+            ) as m(name, time, day_of_week, challenge_week_id, challenger, tz, challenge_id)
+        ), inserted as (
+            insert into checkins
+                (name, time, tier, day_of_week, text, challenge_week_id, challenger, tz)
+            select
+                name, time, 'T1', day_of_week, 'MULLIGAN T1 checkin',
+                challenge_week_id, challenger, tz
+            from m
+            returning id, challenger, challenge_week_id
+        )
+        update challenger_challenges cc
+        set mulligan = inserted.id
+        from inserted
+        join m on
+            m.challenger = inserted.challenger
+            and m.challenge_week_id = inserted.challenge_week_id
+        where cc.challenger_id = inserted.challenger and cc.challenge_id = m.challenge_id
+        returning inserted.id, inserted.challenger, inserted.challenge_week_id;
         """,
         (
-            participant.name,
-            mulligan_time,
-            day_name,
-            challenge_week.challenge_week_id,
-            participant.id,
-            participant.tz,
+            [p.name for p, _, _, _ in mulligans],
+            [mulligan_time_for(p.tz, missing_date) for p, _, _, missing_date in mulligans],
+            [day_name for _, _, day_name, _ in mulligans],
+            [w.challenge_week_id for _, w, _, _ in mulligans],
+            [p.id for p, _, _, _ in mulligans],
+            [p.tz for p, _, _, _ in mulligans],
+            [w.challenge_id for _, w, _, _ in mulligans],
         ),
     )
-    mulligan_id = cur.fetchone().id
-    cur.execute(
-        """
-        update challenger_challenges
-        set mulligan = %s
-        where challenger_id = %s and challenge_id = %s;
-        """,
-        (mulligan_id, participant.id, challenge_week.challenge_id),
-    )
-    return mulligan_id, day_name
+    return {(r.challenger, r.challenge_week_id): r.id for r in cur.fetchall()}
 
 
-def knock_out_challenger(cur, participant, challenge_week):
+def knock_out_challengers(cur, knockouts):
+    """Knocks out every (participant, challenge_week) in one statement."""
+    if not knockouts:
+        return
     cur.execute(
         """
-        update challenger_challenges
+        update challenger_challenges cc
         set knocked_out = true
-        where challenger_id = %s and challenge_id = %s;
+        from unnest(%s::bigint[], %s::bigint[]) as k(challenger_id, challenge_id)
+        where cc.challenger_id = k.challenger_id and cc.challenge_id = k.challenge_id;
         """,
-        (participant.id, challenge_week.challenge_id),
+        (
+            [p.id for p, _ in knockouts],
+            [w.challenge_id for _, w in knockouts],
+        ),
     )
 
 
-def apply_auto_knockout_for_week(cur, challenge_week, participants, run_date):
-    required_checkins = required_checkins_for_week(challenge_week.green)
-    remaining_days = remaining_week_days(run_date, challenge_week.end)
+def decide_auto_knockouts(weeks_with_participants, run_date):
+    """
+    What to do with each participant, in order: [(action, participant,
+    challenge_week, required_checkins, remaining_checkin_days)]. Weeks are
+    judged in the order given, and a challenger knocked out or given their
+    mulligan in one week of a challenge is treated that way in the weeks
+    after it.
+    """
     run_day = run_date.strftime("%A")
-    events = []
+    knocked_out = set()
+    used_mulligan = set()
+    decisions = []
 
-    for participant in participants:
-        checkin_count = participant.checkin_count or 0
-        needed_checkins = required_checkins - checkin_count
-        effective_remaining_days = effective_remaining_week_days(
-            remaining_days,
-            run_day,
-            participant.current_day_checked_in,
-        )
+    for challenge_week, participants in weeks_with_participants:
+        required_checkins = required_checkins_for_week(challenge_week.green)
+        remaining_days = remaining_week_days(run_date, challenge_week.end)
 
-        # Still mathematically able to meet the requirement by checking in
-        # every remaining day: no action.
-        if needed_checkins <= len(effective_remaining_days):
-            continue
+        for participant in participants:
+            key = (participant.id, challenge_week.challenge_id)
+            if key in knocked_out:
+                continue
+
+            checkin_count = participant.checkin_count or 0
+            needed_checkins = required_checkins - checkin_count
+            effective_remaining_days = effective_remaining_week_days(
+                remaining_days,
+                run_day,
+                participant.current_day_checked_in,
+            )
+
+            # Still mathematically able to meet the requirement by checking in
+            # every remaining day: no action.
+            if needed_checkins <= len(effective_remaining_days):
+                continue
+
+            # A mulligan is worth exactly one check-in, so it only helps if it
+            # brings the week back within reach.
+            mulligan_can_save = needed_checkins - 1 <= len(effective_remaining_days)
+            has_mulligan = participant.mulligan is None and key not in used_mulligan
+
+            if has_mulligan and mulligan_can_save:
+                used_mulligan.add(key)
+                action = "mulligan"
+            else:
+                knocked_out.add(key)
+                action = "knockout"
+            decisions.append(
+                (action, participant, challenge_week, required_checkins, effective_remaining_days)
+            )
+
+    return decisions
 
-        # A mulligan is worth exactly one check-in, so it only helps if it
-        # brings the week back within reach.
-        mulligan_can_save = needed_checkins - 1 <= len(effective_remaining_days)
 
-        if participant.mulligan is None and mulligan_can_save:
-            mulligan_id, mulligan_day = insert_mulligan(cur, participant, challenge_week)
+def apply_auto_knockouts(cur, weeks_with_participants, run_date):
+    """Decides every week's knockouts and mulligans, then applies them in bulk."""
+    decisions = decide_auto_knockouts(weeks_with_participants, run_date)
+
+    mulligans = []
+    for action, participant, challenge_week, _, _ in decisions:
+        if action != "mulligan":
+            continue
+        day_name, missing_date = first_missed_day(
+            challenge_week.start,
+            participant.checked_in_days,
+        )
+        if day_name is None:
+            logging.warning("No missing mulligan day found for %s", participant.name)
+            continue
+        mulligans.append((participant, challenge_week, day_name, missing_date))
+    mulligan_days = {
+        (p.id, w.challenge_week_id): day_name for p, w, day_name, _ in mulligans
+    }
+    mulligan_ids = insert_mulligans(cur, mulligans)
+    knock_out_challengers(
+        cur, [(p, w) for action, p, w, _, _ in decisions if action == "knockout"]
+    )
+
+    events = []
+    for action, participant, challenge_week, required_checkins, remaining_days in decisions:
+        checkin_count = participant.checkin_count or 0
+        if action == "mulligan":
+            key = (participant.id, challenge_week.challenge_week_id)
             events.append(
                 AutoKnockoutEvent(
                     action="mulligan",
@@ -348,13 +432,12 @@ def apply_auto_knockout_for_week(cur, challenge_week, participants, run_date):
                     checkin_count=checkin_count,
                     challenge_week_id=challenge_week.challenge_week_id,
                     discord_id=participant.discord_id,
-                    mulligan_checkin_id=mulligan_id,
-                    mulligan_day=mulligan_day,
-                    remaining_checkin_days=effective_remaining_days,
+                    mulligan_checkin_id=mulligan_ids.get(key),
+                    mulligan_day=mulligan_days.get(key),
+                    remaining_checkin_days=remaining_days,
                 )
             )
         else:
-            knock_out_challenger(cur, participant, challenge_week)
             events.append(
                 AutoKnockoutEvent(
                     action="knockout",
@@ -371,6 +454,10 @@ def apply_auto_knockout_for_week(cur, challenge_week, participants, run_date):
     return events
 
 
+def apply_auto_knockout_for_week(cur, challenge_week, participants, run_date):
+    return apply_auto_knockouts(cur, [(challenge_week, participants)], run_date)
+
+
 def build_auto_knockout_alerts_for_week(challenge_week, run_date, participants):
     if challenge_week.bye_week:
         return []
@@ -532,75 +619,108 @@ def build_auto_knockout_daily_message(action_events, warning_events):
     return "\n".join(sections)
 
 
-def run_auto_knockout():
-    from helpers import with_psycopg
-
-    def fn(conn, cur):
-        run_date = datetime.now(tz=ZoneInfo("America/New_York")).date()
-        events = []
-
-        # The week that ended yesterday (if any) catches final-day failures
-        # that were never mathematically doomed mid-week; the current week
-        # catches challengers who can no longer meet the requirement.
-        weeks = [
-            ("previous", get_previous_challenge_week(cur)),
-            ("current", get_current_challenge_week(cur)),
-        ]
-
-        for label, challenge_week in weeks:
-            if challenge_week is None:
-                logging.info("Auto-knockout skipped: no %s challenge week", label)
-                continue
+def knockout_week(challenge_week):
+    """A calendar week in the shape of the week queries above, or None."""
+    if challenge_week is None:
+        return None
+    return SimpleNamespace(
+        challenge_id=challenge_week.challenge_id,
+        challenge_week_id=challenge_week.id,
+        start=challenge_week.start,
+        end=challenge_week.end,
+        green=bool(challenge_week.green),
+        bye_week=challenge_week.bye_week,
+    )
 
-            if challenge_week.bye_week:
-                logging.info(
-                    "Auto-knockout skipped: challenge week %s is a bye week",
-                    challenge_week.challenge_week_id,
-                )
-                continue
 
-            participants = get_participants_for_week(
-                cur,
-                challenge_week.challenge_id,
+def reconcile_weeks(cur, run_date, weeks):
+    """
+    Applies mulligans and knockouts across weeks, returns the events.
+    Weeks are judged in the order given, previous weeks first.
+    """
+    active_weeks = []
+    for challenge_week in weeks:
+        if challenge_week.bye_week:
+            logging.info(
+                "Auto-knockout skipped: challenge week %s is a bye week",
                 challenge_week.challenge_week_id,
-                run_date.strftime("%A"),
             )
-            events.extend(
-                apply_auto_knockout_for_week(cur, challenge_week, participants, run_date)
-            )
-
-        return events
+        else:
+            active_weeks.append(challenge_week)
+    if not active_weeks:
+        logging.info("Auto-knockout skipped: no challenge weeks to check")
+        return []
 
-    return with_psycopg(fn)
+    participants_by_week = defaultdict(list)
+    for participant in get_participants_for_weeks(
+        cur, active_weeks, run_date.strftime("%A")
+    ):
+        participants_by_week[participant.challenge_week_id].append(participant)
+    return apply_auto_knockouts(
+        cur,
+        [(w, participants_by_week[w.challenge_week_id]) for w in active_weeks],
+        run_date,
+    )
 
 
-def run_auto_knockout_alerts():
+def run_auto_knockout():
     from helpers import with_psycopg
 
     def fn(conn, cur):
-        challenge_week = get_current_challenge_week(cur)
-        if challenge_week is None:
-            logging.info("Auto-knockout alerts skipped: no current challenge week")
-            return []
-
-        if challenge_week.bye_week:
-            logging.info(
-                "Auto-knockout alerts skipped: challenge week %s is a bye week",
-                challenge_week.challenge_week_id,
-            )
-            return []
-
         run_date = datetime.now(tz=ZoneInfo("America/New_York")).date()
-        participants = get_alert_participants_for_week(
+
+        # The weeks that ended yesterday catch final-day failures that were
+        # never mathematically doomed mid-week; the current weeks catch
+        # challengers who can no longer meet the requirement.
+        return reconcile_weeks(
             cur,
-            challenge_week.challenge_id,
-            challenge_week.challenge_week_id,
-            run_date.strftime("%A"),
-        )
-        return build_auto_knockout_alerts_for_week(
-            challenge_week,
             run_date,
-            participants,
+            get_previous_challenge_weeks(cur) + get_current_challenge_weeks(cur),
         )
 
     return with_psycopg(fn)
+
+
+def alerts_for_week(cur, challenge_week, run_date):
+    if challenge_week.bye_week:
+        logging.info(
+            "Auto-knockout alerts skipped: challenge week %s is a bye week",
+            challenge_week.challenge_week_id,
+        )
+        return []
+
+    participants = get_alert_participants_for_week(
+        cur,
+        challenge_week.challenge_id,
+        challenge_week.challenge_week_id,
+        run_date.strftime("%A"),
+    )
+    return build_auto_knockout_alerts_for_week(
+        challenge_week,
+        run_date,
+        participants,
+    )
+
+
+def alerts_for_weeks(cur, weeks, run_date):
+    if not weeks:
+        logging.info("Auto-knockout alerts skipped: no current challenge week")
+    return [
+        event
+        for challenge_week in weeks
+        for event in alerts_for_week(cur, challenge_week, run_date)
+    ]
+
+
+def auto_knockout_alerts(cur):
+    return alerts_for_weeks(
+        cur,
+        get_current_challenge_weeks(cur),
+        datetime.now(tz=ZoneInfo("America/New_York")).date(),
+    )
+
+
+def run_auto_knockout_alerts():
+    from helpers import with_psycopg
+
+    return with_psycopg(lambda conn, cur: auto_knockout_alerts(cur))
@@ -1,33 +1,29 @@
 from helpers import fetchone, fetchall
+from cache import cached
+import challenge_calendar
+import roster
 from datetime import datetime, timedelta, date
 import pytz
 import logging
-import itertools
 
 
+@cached("challenge:{challenge_id}")
 def points_so_far(challenge_id):
     return fetchall("select * from get_challenge_score(%s, FALSE)", [challenge_id])
 
 
+@cached("challenges")
 def get_challenges():
     return fetchall("select * from challenges")
 
 
-def bi_checkins(challenge_id):
-    sql = "select sum(bi_checkins) from challenger_challenges where challenge_id = %s"
-    return fetchone(sql, [challenge_id]).sum
-
-
-def points_knocked_out(challenge_id):
-    return fetchall("select * from get_challenge_score(%s, TRUE)", [challenge_id])
-
-
+@cached("challenge:{challenge_id}")
 def challenge_data(challenge_id):
     return fetchone("select * from challenges where id = %s;", [challenge_id])
 
 
 def challenger_by_discord_id(discord_id):
-    return fetchone("select * from challengers where discord_id = %s", [discord_id])
+    return roster.by_discord_id(discord_id)
 
 
 def update_challenger_bmr(challenger_id, bmr):
@@ -38,13 +34,6 @@ def update_challenger_bmr(challenger_id, bmr):
     return fn
 
 
-def total_ante(challenge_id, tier):
-    return fetchone(
-        "select sum(ante) from challenger_challenges where challenge_id = %s and tier = %s",
-        (challenge_id, tier),
-    ).sum
-
-
 def total_possible_checkins_so_far(challenge_id, week_id):
     sql = "select count(*) * 5 as total_possible from challenge_weeks where challenge_id = %s and id < %s;"
     checkins_possible_before_now = fetchone(sql, (challenge_id, week_id))[0]
@@ -53,42 +42,57 @@ def total_possible_checkins_so_far(challenge_id, week_id):
     return checkins_possible_before_now + min(day_of_week + 1, 5)
 
 
+def total_possible_checkins_through(challenge_id, week_id):
+    sql = "select count(*) * 5 as total_possible from challenge_weeks where challenge_id = %s and id <= %s;"
+    return fetchone(sql, (challenge_id, week_id))[0]
+
+
 def total_possible_checkins(challenge_id):
     sql = "select count(*) * 5 as total_possible from challenge_weeks where challenge_id = %s;"
     return fetchone(sql, [challenge_id])
 
 
-def challenge_weeks():
+def challenger_state(name):
+    """Fingerprint of a challenger's settings page, None for unknown names."""
     sql = """
-        select c.name, cw.id, cw.start from challenge_weeks cw
-        join challenges c on cw.challenge_id = c.id
-        order by cw.start
-        """
-    challenges = fetchall(sql, [])
-    return [
-        list(value) for n, value in itertools.groupby(challenges, key=lambda x: x.name)
-    ]
+    select concat_ws('|',
+        ch.id, ch.bmr, ch.tz,
+        (
+            select string_agg(concat_ws(',', cc.challenge_id, cc.mulligan), ';' order by cc.challenge_id)
+            from challenger_challenges cc
+            join challenges c on c.id = cc.challenge_id
+            where cc.challenger_id = ch.id
+            and c.start <= CURRENT_DATE and c."end" >= CURRENT_DATE
+        )
+    ) as state
+    from challengers ch
+    where ch.name = %s
+    """
+    return fetchone(sql, [name])
 
 
 def get_current_challenge_week(tz="America/New_York"):
-    sql = """
-        select * from challenge_weeks 
-        where 
-            week_of_year = extract(week from current_timestamp at time zone %s) and
-            (current_timestamp at time zone 'America/New_York')::date >= start and (current_timestamp at time zone 'America/New_York')::date <= "end";
-        """
-    return fetchone(sql, [tz])
+    return challenge_calendar.current_week(tz=tz)
 
 
-def get_current_challenge():
-    return fetchone(
-        """
-        select * from challenges where 
-        (current_timestamp at time zone 'America/New_York')::date >= start and (current_timestamp at time zone 'America/New_York')::date <= "end";
+def get_current_challenge_week_for(challenger, at=None, tz=None):
     """
-    )
+    The current week to file challenger's check-ins under. Overlapping
+    challenges each have a current week, so take the newest one from a
+    challenge they're in; the plain current week when they're in none.
+    """
+    weeks = challenge_calendar.weeks_at(at, tz=tz or challenger.tz)
+    for week in weeks:
+        if any(m.challenger_id == challenger.id for m in roster.members(week.challenge_id)):
+            return week
+    return weeks[0] if weeks else None
+
+
+def get_current_challenge():
+    return challenge_calendar.current_challenge()
 
 
+@cached("week:{challenge_week_id}")
 def checkins_this_week(challenge_week_id):
     sql = """
     select
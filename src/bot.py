@@ -1,94 +1,77 @@
+import asyncio
 import discord
+import io
 from discord.ui import Modal, Select, InputText, Button
 import re
 import logging
-from collections import defaultdict
 from helpers import fetchall, fetchone, with_psycopg
 from base_queries import *
 from green import determine_if_green
 import os
 from utils import get_tier
-import medals
-import slash_commands.quit as quit_slash
-import slash_commands.join as join_slash
-import slash_commands.calc
-import slash_commands.bmr
-from chart import checkin_chart, diamond_week_holders, red_week_holders, week_heat_map_from_checkins, write_og_image
-from rule_sets import calculate_total_score
-import medal_log
+import checkin_jobs
+import render_pool
+import chart_png
+import async_db
+import discord_dispatch
+import outbox
+import cache
+import change_feed
 from discord_bot import bot
 
 LOGLEVEL = os.environ.get("LOGLEVEL", "DEBUG").upper()
 logging.basicConfig(level=LOGLEVEL)
 ALLOWED_MESSAGE_CHANNEL_ID = str(os.environ.get("ALLOWED_MESSAGE_CHANNEL_ID"))
 
-# Import medal metadata and names from medals module
-from medals import medal_metadata, nice_medal_names
-
-
-def describe_medal(medal_name):
-    fallback = medal_name.replace("_", " ").replace("  ", " ").title()
-    return nice_medal_names.get(medal_name, fallback)
+dispatcher = discord_dispatch.Dispatcher(discord_dispatch.DiscordHttp(bot))
 
 
 def get_medal_group(medal_name):
     """Get the group (A-D) for a medal"""
+    from medals import medal_metadata
+
     metadata = medal_metadata.get(medal_name)
     return metadata["group"] if metadata else None
 
 
 def get_medal_difficulty(medal_name):
     """Get the difficulty (1-4) for a medal"""
+    from medals import medal_metadata
+
     metadata = medal_metadata.get(medal_name)
     return metadata["difficulty"] if metadata else None
 
 
+_sender = None
+
+
 @bot.event
 async def on_ready():
+    global _sender
     print(f"{bot.user} is ready and online!")
+    change_feed.start()
+    # on_ready fires again after reconnects, the sender keeps running.
+    if _sender is None:
+        _sender = asyncio.ensure_future(outbox.run_sender(dispatcher))
 
 
 @bot.slash_command(name="chart", description="Display the current chart")
 async def get_chart(ctx: discord.ApplicationContext):
-    current_challenge = get_current_challenge()
-    selected_challenge_week = get_current_challenge_week()
-    checkins = checkins_this_week(selected_challenge_week.id)
-    total_points = calculate_total_score(current_challenge.id)
-    week, latest, achievements = week_heat_map_from_checkins(
-        checkins,
-        current_challenge.id,
-        current_challenge.rule_set,
-    )
-    week = sorted(
-        week, key=lambda x: -total_points[x.name] if x.name in total_points else 0
-    )
-    total_checkins = {x[1]: x[0] for x in points_so_far(current_challenge.id)}
-    logging.info("TOTAL CHECKINS %s", total_checkins)
-    logging.debug("WEEK: %s, LATEST: %s", week, latest)
-    chart = checkin_chart(
-        week,
-        1000,
-        600,
-        current_challenge.id,
-        selected_challenge_week.green,
-        selected_challenge_week.bye_week,
-        total_points,
-        achievements,
-        total_checkins,
-        total_possible_checkins(current_challenge.id)[0],
-        total_possible_checkins_so_far(
-            current_challenge.id, selected_challenge_week.id
-        ),
-        red_week_names=red_week_holders(selected_challenge_week.id),
-        diamond_week_names=diamond_week_holders(selected_challenge_week.id),
+    await ctx.defer(ephemeral=True)
+    try:
+        png = await chart_png.current_png()
+    except (render_pool.RenderQueueFull, render_pool.RenderTimeout):
+        await ctx.followup.send("The chart is busy rendering, try again in a bit.", ephemeral=True)
+        return
+    await ctx.followup.send(
+        file=discord.File(io.BytesIO(png), filename="chart.png"),
+        ephemeral=True,
     )
-    write_og_image(chart, selected_challenge_week.id)
-    await send_current_chart(ctx)
 
 
 @bot.slash_command(name="green", description="Check if it's a green week")
 async def green(ctx: discord.ApplicationContext):
-    green_week = determine_if_green()
+    green_week = await async_db.run(determine_if_green)
     if green_week == True:
         await ctx.send_response("It's a green week!")
     else:
@@ -98,11 +81,15 @@ async def green(ctx: discord.ApplicationContext):
 
 @bot.slash_command(name="quit", description="I can't handle the challenge.")
 async def quit_command(ctx: discord.ApplicationContext):
+    import slash_commands.quit as quit_slash
+
     await ctx.respond("You sure?", view=quit_slash.Button())
 
 
 @bot.slash_command(name="join", description="I'm ready to win.")
 async def join_command(ctx: discord.ApplicationContext):
+    import slash_commands.join as join_slash
+
     await ctx.respond("You ready to win?", view=join_slash.Button())
 
 
@@ -110,6 +97,8 @@ async def join_command(ctx: discord.ApplicationContext):
     name="calculate_tier", description="Calculate the tier for your checkin"
 )
 async def calc_command(ctx: discord.ApplicationContext):
+    import slash_commands.calc
+
     await ctx.send_modal(slash_commands.calc.Modal(title="Enter Checkin Details"))
 
 
@@ -117,6 +106,8 @@ async def calc_command(ctx: discord.ApplicationContext):
     name="bmr", description="Calculate and update your BMR"
 )
 async def bmr_command(ctx: discord.ApplicationContext):
+    import slash_commands.bmr
+
     await slash_commands.bmr.launch_bmr_modal(ctx)
 
 
@@ -133,12 +124,12 @@ async def podium_test_command(ctx: discord.ApplicationContext):
 
     await ctx.defer()  # Acknowledge the command since this might take a moment
 
-    challenge = get_most_recently_ended_challenge()
+    challenge = await async_db.run(get_most_recently_ended_challenge)
     if not challenge:
         await ctx.followup.send("No ended challenge found.")
         return
 
-    msg = generate_challenge_results_message(challenge)
+    msg = await async_db.run(generate_challenge_results_message, challenge)
     if not msg:
         await ctx.followup.send(
             f"Could not generate results for challenge: {challenge.name}"
@@ -191,7 +182,7 @@ async def uncheckin(ctx: discord.ApplicationContext):
         )
         return
 
-    challenger = challenger_by_discord_id(str(user.id))
+    challenger = await async_db.run(challenger_by_discord_id, str(user.id))
     if challenger is None:
         await ctx.respond(
             "You’re not currently registered for the challenge, so there’s no check-in to clear.",
@@ -199,7 +190,7 @@ async def uncheckin(ctx: discord.ApplicationContext):
         )
         return
 
-    challenge_week = get_current_challenge_week(challenger.tz)
+    challenge_week = await async_db.run(get_current_challenge_week_for, challenger)
     if challenge_week is None:
         await ctx.respond(
             "There is no active challenge week right now, so there’s no check-in for today to clear.",
@@ -207,9 +198,10 @@ async def uncheckin(ctx: discord.ApplicationContext):
         )
         return
 
-    deleted_count = with_psycopg(
-        clear_today_checkins_for_challenger(challenger, challenge_week)
+    deleted_count = await async_db.run(
+        with_psycopg, clear_today_checkins_for_challenger(challenger, challenge_week)
     )
+    await async_db.run(cache.invalidate_week, challenge_week)
 
     if deleted_count == 0:
         await ctx.respond(
@@ -218,9 +210,9 @@ async def uncheckin(ctx: discord.ApplicationContext):
         )
         return
 
-    challenge = get_current_challenge()
-    if challenge is not None:
-        medals.update_medal_table(challenge.id, challenge_week.id)
+    # Medals move with the removed check-in, the worker recomputes them as
+    # it does after a new one.
+    await async_db.run(checkin_jobs.enqueue, None, challenge_week.id)
 
     await ctx.respond(
         f"<@{user.id}>'s last check-in from today was removed.",
@@ -247,115 +239,35 @@ async def on_message(message):
     logging.info("DISCORD: tier from message: %s", tier)
 
     # Mark all valid check-ins
-    await message.add_reaction("✅")
-
+    reactions = ["✅"]
     if int(tier[1:]) > 10:
-        await message.add_reaction("🔥")
-
-    checkin_id = save_checkin(message.content, tier, message.author.id)
-
-    challenge_week = get_current_challenge_week()
-    challenge = get_current_challenge()
-    medals.update_medal_table(challenge.id, challenge_week.id)
-    log = medal_log.get_medal_log(challenge_week.id)
-    logging.info("DISCORD: medal log %s", log)
-
-    relevant_medals = [medal for medal in log if medal.checkin_id == checkin_id]
-    if relevant_medals:
-        logging.info("DISCORD: medals for checkin %s", relevant_medals)
-        
-        # Add reactions for all medals
-        for medal in relevant_medals:
-            await message.add_reaction(medal.medal_emoji)
-        
-        # Group medals by user, action type, and (for steals) the person they stole from
-        grouped_medals = defaultdict(list)
-        
-        for medal in relevant_medals:
-            nice_name = describe_medal(medal.medal_name)
-            emoji = medal.medal_emoji or ""
-            medal_display = f"{emoji} __**{nice_name}**__".strip()
-            
-            # Check if this medal was stolen (has a previous holder)
-            if medal.stolen_checkin_challenger_name and medal.stolen_discord_id is not None:
-                if medal.discord_id == medal.stolen_discord_id:
-                    # Special case: still holds and surpassed their own record
-                    key = (medal.discord_id, "still_holds", None)
-                else:
-                    # Stolen from someone else
-                    key = (medal.discord_id, "stole", medal.stolen_discord_id)
-            else:
-                # Earned (no previous holder or invalid steal data)
-                key = (medal.discord_id, "earned", None)
-            
-            grouped_medals[key].append(medal_display)
-        
-        # Format grouped messages
-        # Sort so earned messages come before stolen/still_holds messages
-        def sort_key(item):
-            (discord_id, action_type, stolen_discord_id), medal_list = item
-            # Return 0 for "earned", 1 for others to ensure earned comes first
-            return (0 if action_type == "earned" else 1, discord_id, action_type, stolen_discord_id or "")
-        
-        medal_message = ""
-        for (discord_id, action_type, stolen_discord_id), medal_list in sorted(grouped_medals.items(), key=sort_key):
-            # Format medal list with commas and "and"
-            if len(medal_list) == 1:
-                medals_text = medal_list[0]
-            elif len(medal_list) == 2:
-                medals_text = f"{medal_list[0]} and {medal_list[1]}"
-            else:
-                medals_text = ", ".join(medal_list[:-1]) + f", and {medal_list[-1]}"
-            
-            if action_type == "still_holds":
-                pronoun = "them" if len(medal_list) > 1 else "it"
-                medal_message += (
-                    f"\n\n<@{discord_id}> still holds {medals_text}, and has now surpassed {pronoun}!"
-                )
-            elif action_type == "stole":
-                # Validate stolen_discord_id to prevent invalid mentions
-                if stolen_discord_id is not None:
-                    medal_message += (
-                        f"\n\n<@{discord_id}> stole {medals_text} from <@{stolen_discord_id}>!"
-                    )
-                else:
-                    # Fallback if stolen_discord_id is None (shouldn't happen, but safety check)
-                    logging.warning(f"stolen_discord_id is None for steal action by {discord_id}")
-                    medal_message += (
-                        f"\n\n<@{discord_id}> stole {medals_text}!"
-                    )
-            else:  # earned
-                medal_message += (
-                    f"\n\n<@{discord_id}> earned {medals_text}!"
-                )
-        
-        logging.info("DISCORD: %s", medal_message)
-        await message.reply(medal_message)
-
-
-async def send_current_chart(message):
-    challenge_week = get_current_challenge_week()
-    await message.send_response(
-        file=discord.File(open(f"/src/static/preview-{challenge_week.id}.png", "rb")),
-        ephemeral=True,
+        reactions.append("🔥")
+    dispatcher.react(message.channel.id, message.id, reactions)
+
+    checkin_id, challenge_week = await async_db.run(
+        save_checkin, message.content, tier, message.author.id
+    )
+
+    # Medals take a dozen queries; the worker works them out and replies
+    # with the announcement.
+    await async_db.run(
+        checkin_jobs.enqueue, checkin_id, challenge_week.id, message_id=message.id
     )
 
 
 def save_checkin(message, tier, discord_id):
-    challenger = fetchone(
-        "select * from challengers where discord_id = %s",
-        [str(discord_id)],
-    )
-    challenge_week = get_current_challenge_week(challenger.tz)
+    challenger = challenger_by_discord_id(discord_id)
+    challenge_week = get_current_challenge_week_for(challenger)
 
     logging.info("DISCORD: challenger %s", challenger)
     logging.info("DISCORD: challenge week %s", challenge_week.id)
 
     id = with_psycopg(insert_checkin(message, tier, challenger, challenge_week.id))
+    cache.invalidate_week(challenge_week)
 
     logging.info("DISCORD: inserted checkin id: %s for %s", id, challenger)
 
-    return id
+    return id, challenge_week
 
 
 if __name__ == "__main__":
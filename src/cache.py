@@ -0,0 +1,284 @@
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import threading
+import time
+from functools import wraps
+
+# Shared by the web workers, the bot and the rq workers when set, e.g.
+# redis://valkey:6379/1. Without it every process keeps its own cache and
+# only sees its own invalidations, which is only right for a single process.
+CACHE_URL = os.environ.get("CACHE_URL")
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 600))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 2048))
+KEY_PREFIX = "cache:"
+TAG_PREFIX = "cache-tag:"
+
+
+class Row(tuple):
+    """
+    Picklable stand-in for psycopg's namedtuple rows, whose classes are
+    generated per query and can't be pickled. Supports the same attribute,
+    index and _asdict access.
+    """
+
+    def __new__(cls, fields, values):
+        row = super().__new__(cls, values)
+        row._fields = tuple(fields)
+        return row
+
+    def __getattr__(self, name):
+        if name == "_fields":
+            raise AttributeError(name)
+        try:
+            return self[self._fields.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+    def __reduce__(self):
+        return (Row, (self._fields, tuple(self)))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return "Row(%s)" % ", ".join(
+            "%s=%r" % (name, value) for name, value in zip(self._fields, self)
+        )
+
+
+def freeze(value):
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        if type(value).__module__.startswith("psycopg"):
+            return Row(value._fields, [freeze(v) for v in value])
+        return type(value)(*[freeze(v) for v in value])
+    if isinstance(value, list):
+        return [freeze(v) for v in value]
+    if isinstance(value, dict):
+        return {k: freeze(v) for k, v in value.items()}
+    return value
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            result = []
+            for key in keys:
+                entry = self.values.get(key)
+                if entry is not None and entry[0] is not None and entry[0] < now:
+                    del self.values[key]
+                    entry = None
+                result.append(None if entry is None else entry[1])
+            return result
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = (time.monotonic() + ttl, value)
+            # dicts keep insertion order so the first key is the oldest write
+            while len(self.values) > self.max_entries:
+                del self.values[next(iter(self.values))]
+
+    def add(self, key, value, ttl):
+        """Sets key only if it isn't already set, True if it was."""
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is not None and (entry[0] is None or entry[0] >= time.monotonic()):
+                return False
+            self.values[key] = (time.monotonic() + ttl, value)
+            return True
+
+    def delete_if(self, key, value):
+        """Deletes key only while it still holds value."""
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is not None and entry[1] == value:
+                del self.values[key]
+
+    def incr(self, key):
+        with self.lock:
+            _, value = self.values.get(key, (None, b"0"))
+            value = str(int(value) + 1).encode()
+            # tag versions never expire, losing one would revive stale entries
+            self.values[key] = (None, value)
+            return value
+
+
+class ValkeyBackend:
+    def __init__(self, url):
+        import valkey
+
+        self.client = valkey.from_url(url, socket_timeout=0.5)
+        self.delete_if_script = self.client.register_script(
+            """
+            if redis.call('get', KEYS[1]) == ARGV[1] then
+                return redis.call('del', KEYS[1])
+            end
+            return 0
+            """
+        )
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, ex=ttl, nx=True))
+
+    def delete_if(self, key, value):
+        self.delete_if_script(keys=[key], args=[value])
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = ValkeyBackend(CACHE_URL) if CACHE_URL else MemoryBackend()
+        return _backend
+
+
+def set_backend(new_backend):
+    global _backend
+    with _lock:
+        _backend = new_backend
+
+
+def tag_versions(tags):
+    if not tags:
+        return ()
+    return tuple(v or b"0" for v in backend().get_many([TAG_PREFIX + t for t in tags]))
+
+
+def invalidate(*tags):
+    """
+    Drops every entry carrying any of tags. Call after the write has
+    committed, otherwise a reader can cache the old state under the new
+    version.
+    """
+    for tag in tags:
+        try:
+            backend().incr(TAG_PREFIX + tag)
+        except Exception:
+            logging.exception("Cache invalidation failed for %s", tag)
+
+
+def invalidate_week(challenge_week):
+    """For writes to a week's check-ins, which also move the challenge totals."""
+    invalidate(
+        "week:%s" % challenge_week.id, "challenge:%s" % challenge_week.challenge_id
+    )
+
+
+def make_key(*parts):
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def lookup(key, tags):
+    """Current tag versions and the cached value, if any."""
+    try:
+        versions = tag_versions(tags)
+    except Exception:
+        logging.exception("Cache read failed for %s", key)
+        return None, None
+    try:
+        raw = backend().get_many([KEY_PREFIX + key])[0]
+    except Exception:
+        logging.exception("Cache read failed for %s", key)
+        return versions, None
+    if raw is not None:
+        stored_versions, value = pickle.loads(raw)
+        if stored_versions == versions:
+            return versions, value
+    return versions, None
+
+
+def store(key, versions, value, ttl):
+    if versions is None:
+        return
+    try:
+        backend().set(KEY_PREFIX + key, pickle.dumps((versions, value)), ttl)
+    except Exception:
+        logging.exception("Cache write failed for %s", key)
+
+
+def cached(*tags, ttl=CACHE_TTL_SECONDS):
+    """
+    Caches the function's result by its arguments. tags are format strings
+    filled from the arguments by name, e.g. "challenge:{challenge_id}".
+    """
+
+    def decorator(f):
+        signature = inspect.signature(f)
+        name = "%s.%s" % (f.__module__, f.__qualname__)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            entry_tags = [t.format(**bound.arguments) for t in tags]
+            key = make_key(name, bound.args, sorted(bound.kwargs.items()))
+
+            versions, value = lookup(key, entry_tags)
+            if value is not None:
+                return value
+            value = freeze(f(*args, **kwargs))
+            if value is not None:
+                store(key, versions, value, ttl)
+            return value
+
+        return decorated_function
+
+    return decorator
+
+
+def cached_view(tags_fn, vary=lambda: (), ttl=CACHE_TTL_SECONDS):
+    """
+    Caches a route's 200 responses by path and query string. tags_fn gets
+    the view's arguments and returns the entry's tags, or None to skip the
+    cache. vary returns anything else the page depends on.
+    """
+    # Only the web app caches views; the bot and rq jobs skip loading flask.
+    from flask import Response, request
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            entry_tags = tags_fn(*args, **kwargs)
+            if entry_tags is None:
+                return f(*args, **kwargs)
+            key = make_key("view", request.full_path, vary())
+
+            versions, value = lookup(key, entry_tags)
+            if value is not None:
+                body, mimetype = value
+                return Response(body, mimetype=mimetype)
+
+            response = f(*args, **kwargs)
+            if not isinstance(response, Response):
+                response = Response(response)
+            if response.status_code == 200 and not response.direct_passthrough:
+                store(key, versions, (response.get_data(), response.mimetype), ttl)
+            return response
+
+        return decorated_function
+
+    return decorator
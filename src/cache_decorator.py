@@ -1,27 +1,75 @@
-from flask import Response, request
+from flask import Response, make_response, request
 from functools import wraps
-from helpers import fetchone
-from datetime import datetime
+from typing import NamedTuple, Optional
+from datetime import datetime, timezone
+import hashlib
 
 
-def last_modified(sql):
-    """Executes sql which returns a value to compare against last_modified_at"""
+class Validator(NamedTuple):
+    etag: str
+    last_modified: Optional[datetime] = None
+    cache_control: str = "no-cache"
+
+
+def validator(*parts, last_modified=None, cache_control="no-cache"):
+    """Strong validator over the given parts, anything with a stable str()."""
+    etag = hashlib.sha256(
+        "|".join(str(part) for part in parts).encode("utf-8")
+    ).hexdigest()[:32]
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return Validator(etag, last_modified, cache_control)
+
+
+def is_fresh(v):
+    """
+    If-None-Match wins when the client sent both, If-Modified-Since is only
+    a fallback for clients that never saw the ETag.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(v.etag)
+    if v.last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates only carry whole seconds
+        return v.last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def apply_validator(response, v):
+    response.set_etag(v.etag)
+    if v.last_modified is not None:
+        response.last_modified = v.last_modified
+    response.headers["Cache-Control"] = v.cache_control
+    return response
+
+
+def not_modified(v):
+    return apply_validator(Response(status=304), v)
+
+
+def conditional(validator_fn):
+    """
+    Answers GET and HEAD requests with a 304 when validator_fn, called with
+    the view's arguments, says the client's copy is still current, without
+    running the view at all. validator_fn returns a Validator or None to
+    always render.
+    """
 
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            last_modified = fetchone(sql, []).last_modified
-            if_modified_since = request.headers.get("If-Modified-Since")
-            if if_modified_since and last_modified == datetime.fromisoformat(
-                request.headers.get("If-Modified-Since")
-            ):
-                return Response(status=304)
-
-            response = f(*args, **kwargs)
-            if type(response) is str:
-                response = Response(response)
-            response.headers["Last-Modified"] = last_modified
-            return response
+            if request.method not in ("GET", "HEAD"):
+                return f(*args, **kwargs)
+
+            v = validator_fn(*args, **kwargs)
+            if v is None:
+                return f(*args, **kwargs)
+            if is_fresh(v):
+                return not_modified(v)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return apply_validator(response, v)
 
         return decorated_function
 
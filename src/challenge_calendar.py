@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, NamedTuple
+from zoneinfo import ZoneInfo
+
+import change_feed
+from helpers import fetchall
+
+NEW_YORK = ZoneInfo("America/New_York")
+# Without a change feed listener (rq jobs, scripts) reload this often.
+CALENDAR_TTL_SECONDS = int(os.environ.get("CALENDAR_TTL_SECONDS", 60))
+
+
+class Calendar(NamedTuple):
+    challenges: List[object]
+    weeks: List[object]
+    # challenge id -> its weeks, oldest first
+    weeks_by_challenge: Dict[int, List[object]]
+    # week id -> its 1-based number within the challenge
+    week_numbers: Dict[int, int]
+    weeks_by_id: Dict[int, object]
+    challenges_by_id: Dict[int, object]
+    # the newest challenge wins a shared name
+    challenges_by_name: Dict[str, object]
+    loaded_at: float
+
+
+def build(challenges, weeks):
+    """challenges and weeks come newest first."""
+    weeks_by_challenge = defaultdict(list)
+    for w in reversed(weeks):
+        weeks_by_challenge[w.challenge_id].append(w)
+    week_numbers = {
+        w.id: number
+        for challenge_weeks in weeks_by_challenge.values()
+        for number, w in enumerate(challenge_weeks, start=1)
+    }
+    return Calendar(
+        challenges,
+        weeks,
+        dict(weeks_by_challenge),
+        week_numbers,
+        {w.id: w for w in weeks},
+        {c.id: c for c in challenges},
+        {c.name: c for c in reversed(challenges)},
+        time.monotonic(),
+    )
+
+
+_calendar = None
+_lock = threading.Lock()
+
+
+def load():
+    return build(
+        fetchall("select * from challenges order by start desc, id desc"),
+        fetchall("select * from challenge_weeks order by start desc, id desc"),
+    )
+
+
+def calendar():
+    """Every challenge and week, newest first."""
+    global _calendar
+    current = _calendar
+    if current is not None and (
+        change_feed.is_listening()
+        or time.monotonic() - current.loaded_at < CALENDAR_TTL_SECONDS
+    ):
+        return current
+    with _lock:
+        if _calendar is current:
+            _calendar = load()
+        return _calendar
+
+
+@change_feed.subscribe
+def on_change(change):
+    global _calendar
+    if change.table in ("challenges", "challenge_weeks"):
+        _calendar = None
+
+
+@change_feed.on_connect
+@change_feed.on_disconnect
+def forget():
+    global _calendar
+    _calendar = None
+
+
+def now():
+    return datetime.now(tz=NEW_YORK)
+
+
+def as_new_york(at):
+    """Naive times are taken to already be New York times."""
+    if at.tzinfo is None:
+        return at.replace(tzinfo=NEW_YORK)
+    return at.astimezone(NEW_YORK)
+
+
+def challenges_at(at=None):
+    """Challenges running on at's New York date, newest first."""
+    day = as_new_york(at or now()).date()
+    return [c for c in calendar().challenges if c.start <= day <= c.end]
+
+
+def weeks_at(at=None, tz="America/New_York"):
+    """
+    Weeks running at `at`, newest first: the New York date falls inside the
+    week and the ISO week number, taken in tz, matches week_of_year.
+    Overlapping challenges each contribute their week.
+    """
+    at = as_new_york(at or now())
+    day = at.date()
+    week_of_year = at.astimezone(ZoneInfo(tz)).isocalendar()[1]
+    return [
+        w
+        for w in calendar().weeks
+        if w.week_of_year == week_of_year and w.start <= day <= w.end
+    ]
+
+
+def running_weeks(at=None):
+    """
+    Weeks whose dates cover at's New York date within a running challenge,
+    newest first. Unlike weeks_at this goes by dates alone, whatever the
+    week's stored week_of_year.
+    """
+    day = as_new_york(at or now()).date()
+    running = {c.id for c in challenges_at(at)}
+    return [
+        w
+        for w in calendar().weeks
+        if w.challenge_id in running and w.start <= day <= w.end
+    ]
+
+
+def current_challenge(at=None):
+    challenges = challenges_at(at)
+    return challenges[0] if challenges else None
+
+
+def current_week(at=None, tz="America/New_York"):
+    weeks = weeks_at(at, tz)
+    return weeks[0] if weeks else None
+
+
+def week_by_id(challenge_week_id):
+    try:
+        challenge_week_id = int(challenge_week_id)
+    except (TypeError, ValueError):
+        return None
+    return calendar().weeks_by_id.get(challenge_week_id)
+
+
+def challenge_by_name(name):
+    return calendar().challenges_by_name.get(name)
+
+
+def challenge_by_id(challenge_id):
+    try:
+        challenge_id = int(challenge_id)
+    except (TypeError, ValueError):
+        return None
+    return calendar().challenges_by_id.get(challenge_id)
+
+
+def challenge_weeks(challenge_id):
+    """The challenge's weeks, oldest first."""
+    return calendar().weeks_by_challenge.get(int(challenge_id), [])
+
+
+def week_number(challenge_week):
+    """Which week of its challenge this is, counting from 1."""
+    return calendar().week_numbers.get(challenge_week.id)
@@ -0,0 +1,148 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+import psycopg
+
+import cache
+from helpers import connection_string
+
+# Matches the channel notify_data_change() in sql/change_feed.sql sends on.
+CHANNEL = "data_changed"
+RECONNECT_SECONDS = 5
+
+
+class Change(NamedTuple):
+    table: str
+    challenge_id: Optional[int] = None
+    challenge_week_id: Optional[int] = None
+    challenger_id: Optional[int] = None
+    # scope -> [version, updated_at] as bumped by the trigger
+    versions: Optional[Dict[str, list]] = None
+
+
+def parse(payload):
+    data = json.loads(payload)
+    return Change(
+        data["table"],
+        data.get("challenge_id"),
+        data.get("challenge_week_id"),
+        data.get("challenger_id"),
+        data.get("versions") or {},
+    )
+
+
+def tags(change):
+    """The cache tags a change touches."""
+    result = []
+    if change.challenge_id is not None:
+        result.append("challenge:%s" % change.challenge_id)
+    if change.challenge_week_id is not None:
+        result.append("week:%s" % change.challenge_week_id)
+    if change.challenger_id is not None:
+        result.append("challenger:%s" % change.challenger_id)
+    if change.table in ("challenges", "challenge_weeks"):
+        result.append("challenges")
+    return result
+
+
+_subscribers = []
+_connect_hooks = []
+_disconnect_hooks = []
+_thread = None
+_listening = False
+_lock = threading.Lock()
+
+
+def subscribe(fn):
+    """
+    Calls fn(change) from the listener thread for every change, before the
+    change's cache tags move. Subscribers drop the in-memory state (roster,
+    calendar) pages are built from, so nothing rendered from the old state
+    gets cached under the new tag versions.
+    """
+    _subscribers.append(fn)
+    return fn
+
+
+def on_connect(fn):
+    """
+    Calls fn() each time the listener (re)connects, after LISTEN so nothing
+    committed from then on is missed.
+    """
+    _connect_hooks.append(fn)
+    return fn
+
+
+def on_disconnect(fn):
+    _disconnect_hooks.append(fn)
+    return fn
+
+
+def is_listening():
+    """True while notifications are arriving, so in-memory state is current."""
+    return _listening
+
+
+def run_hooks(hooks):
+    for fn in list(hooks):
+        try:
+            fn()
+        except Exception:
+            logging.exception("Change feed hook %s failed", fn.__qualname__)
+
+
+def invalidate_cache(change):
+    cache.invalidate(*tags(change))
+
+
+def dispatch(change):
+    for fn in list(_subscribers) + [invalidate_cache]:
+        try:
+            fn(change)
+        except Exception:
+            logging.exception("Change feed subscriber %s failed", fn.__qualname__)
+
+
+def listen():
+    global _listening
+    with psycopg.connect(conninfo=connection_string, autocommit=True) as conn:
+        conn.execute("listen %s" % CHANNEL)
+        logging.info("Listening for %s", CHANNEL)
+        run_hooks(_connect_hooks)
+        _listening = True
+        for notify in conn.notifies():
+            try:
+                change = parse(notify.payload)
+            except (ValueError, KeyError):
+                logging.warning("Bad %s payload: %s", CHANNEL, notify.payload)
+                continue
+            dispatch(change)
+
+
+def run():
+    global _listening
+    # Notifications sent while we're reconnecting are lost, on_connect hooks
+    # (see watermark.reload) catch up on what moved in the meantime.
+    while True:
+        try:
+            listen()
+        except Exception:
+            logging.exception(
+                "Change feed listener failed, reconnecting in %ss", RECONNECT_SECONDS
+            )
+        _listening = False
+        run_hooks(_disconnect_hooks)
+        time.sleep(RECONNECT_SECONDS)
+
+
+def start():
+    """Starts the listener thread once per process."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=run, name="change-feed", daemon=True)
+            _thread.start()
+    return _thread
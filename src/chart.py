@@ -1,12 +1,22 @@
-import cairosvg
 import svgwrite
 import logging
 import itertools
+import json
 from typing import List, Dict, NamedTuple
-from helpers import fetchall, fetchone
 from datetime import datetime, timedelta, date
 import os
-from rule_sets import score
+import og_image
+import roster
+from cache import cached
+import watermark
+import week_snapshot
+from rule_sets import calculate_total_score, score
+from base_queries import (
+    checkins_this_week,
+    points_so_far,
+    total_possible_checkins,
+    total_possible_checkins_so_far,
+)
 from medals import red as red_medal_query, diamond as diamond_medal_query
 
 
@@ -43,45 +53,19 @@ class CheckinChartData(NamedTuple):
 
 
 def knocked_out(challenge_id):
-    return [
-        r.name
-        for r in fetchall(
-            """
-        SELECT name FROM challengers c
-        JOIN challenger_challenges cc ON c.id = cc.challenger_id
-        WHERE cc.challenge_id = %s AND cc.knocked_out = true
-        """,
-            [challenge_id],
-        )
-    ]
+    return [m.name for m in roster.members(challenge_id) if m.knocked_out]
 
 
 def get_challenger_info(challenge_id):
-    return fetchall(
-        """
-        SELECT name, cc.tag FROM challengers c
-        JOIN challenger_challenges cc ON c.id = cc.challenger_id
-        WHERE cc.challenge_id = %s
-        """,
-        [challenge_id],
-    )
+    """Members of the challenge, each with a name and tag."""
+    return roster.members(challenge_id)
 
 
 def mulliganed_challengers(challenge_id):
-    return [
-        r.name
-        for r in fetchall(
-            """
-        SELECT name FROM challengers c
-        JOIN challenger_challenges cc ON c.id = cc.challenger_id
-        WHERE cc.challenge_id = %s
-        and cc.mulligan is not null
-        """,
-            [challenge_id],
-        )
-    ]
+    return [m.name for m in roster.members(challenge_id) if m.mulligan is not None]
 
 
+@cached("week:{challenge_week_id}")
 def red_week_holders(challenge_week_id):
     """Return set of challenger names who have (or would have) Red Week for this week.
     Uses the same logic as the Red Week medal (5 check-ins, each T3+), so it works
@@ -90,6 +74,7 @@ def red_week_holders(challenge_week_id):
     return {r.name for r in rows} if rows else set()
 
 
+@cached("week:{challenge_week_id}")
 def diamond_week_holders(challenge_week_id):
     """Return set of challenger names who have (or would have) Diamond Week for this week.
     Uses the same logic as the Diamond Week medal (7 check-ins, each T3+)."""
@@ -111,6 +96,7 @@ def checkin_chart(
     total_possible_checkins_so_far,
     red_week_names=None,
     diamond_week_names=None,
+    knocked_out_names=None,
 ):
     if len(data) == 0:
         logging.warning("empty week + year selected")
@@ -162,7 +148,8 @@ def checkin_chart(
             fill="white" if not green else green_mode,
         )
     )
-    knocked_out_names = knocked_out(challenge_id)
+    if knocked_out_names is None:
+        knocked_out_names = knocked_out(challenge_id)
     logging.info("knocked out: %s", knocked_out_names)
     logging.info("Achievements: %s", achievements)
     text_color = "black" if green else ""
@@ -413,35 +400,140 @@ def write_points(dwg, chart, total_points, x, y):
         dwg.add(text)
 
 
-def write_og_image(svg, week):
+def write_og_image(svg):
+    """
+    Makes sure a preview PNG exists for svg and returns its path relative to
+    the static folder. Previews are keyed by the svg contents so unchanged
+    charts never get re-rendered.
+    """
     try:
-        output = "./static/preview-{week}.png".format(week=week)
-        cairosvg.svg2png(bytestring=svg.encode("utf-8"), write_to=output)
-    except:
-        logging.error("Failed to write og image")
+        return og_image.static_filename(og_image.ensure_png(svg))
+    except Exception:
+        logging.exception("Failed to write og image")
+        return None
+
+
+class WeekChart(NamedTuple):
+    svg: str
+    latest: datetime
+    heat_map: List[CheckinChartData]
+
+
+def week_chart(
+    challenge, challenge_week, current_challenge_week_id, possible_checkins_so_far=None
+):
+    """
+    Runs the queries behind the heat map for challenge_week and draws it.
+    possible_checkins_so_far defaults to the count as of today in the
+    current week.
+    """
+    if possible_checkins_so_far is None:
+        possible_checkins_so_far = total_possible_checkins_so_far(
+            challenge.id, current_challenge_week_id
+        )
+    total_points = calculate_total_score(challenge.id)
+    snapshot = (
+        week_snapshot.load(challenge_week.id)
+        if week_snapshot.is_closed(challenge_week)
+        else None
+    )
+    if snapshot is not None:
+        # Closed week: everything about the week itself comes from the
+        # snapshot, only the challenge wide totals are live.
+        green, bye_week = snapshot.week.green, snapshot.week.bye_week
+        week, latest, achievements = week_heat_map_from_checkins(
+            week_snapshot.snapshot_checkins(snapshot),
+            challenge.id,
+            challenge.rule_set,
+            names_and_tags=snapshot.challengers,
+            mulliganed=[c.name for c in snapshot.challengers if c.mulliganed],
+            latest=snapshot.week.latest,
+        )
+        knocked_out_names = [c.name for c in snapshot.challengers if c.knocked_out]
+        red_week_names = {c.name for c in snapshot.challengers if c.red_week}
+        diamond_week_names = {c.name for c in snapshot.challengers if c.diamond_week}
+    else:
+        green, bye_week = challenge_week.green, challenge_week.bye_week
+        checkins = checkins_this_week(challenge_week.id)
+        logging.debug("Week checkins: %s", [checkin.name for checkin in checkins])
+        week, latest, achievements = week_heat_map_from_checkins(
+            checkins,
+            challenge.id,
+            challenge.rule_set,
+        )
+        knocked_out_names = None
+        red_week_names = red_week_holders(challenge_week.id)
+        diamond_week_names = diamond_week_holders(challenge_week.id)
+    week = sorted(
+        week, key=lambda x: -total_points[x.name] if x.name in total_points else 0
+    )
+    total_checkins = {x[1]: x[0] for x in points_so_far(challenge.id)}
+    logging.info("TOTAL CHECKINS %s", total_checkins)
+    logging.debug("WEEK: %s, LATEST: %s", week, latest)
+    svg = checkin_chart(
+        week,
+        1000,
+        600,
+        challenge.id,
+        green,
+        bye_week,
+        total_points,
+        achievements,
+        total_checkins,
+        total_possible_checkins(challenge.id)[0],
+        possible_checkins_so_far,
+        red_week_names=red_week_names,
+        diamond_week_names=diamond_week_names,
+        knocked_out_names=knocked_out_names,
+    )
+    return WeekChart(svg, latest, week)
+
+
+def heat_map_to_json(heat_map):
+    return json.dumps(
+        [
+            {
+                "name": row.name,
+                "tag": row.tag,
+                "totalCheckins": row.totalCheckins,
+                "points": row.points,
+                "hasMulliganed": row.hasMulliganed,
+                "data": [
+                    {
+                        **unit._asdict(),
+                        "time": unit.time.isoformat() if unit.time else None,
+                    }
+                    for unit in row.data
+                ],
+            }
+            for row in heat_map
+        ]
+    )
 
 
 def sortCheckinByWeekday(data: List[str]) -> List[str]:
     return sorted(data, key=lambda x: weekdays.index(x.day_of_week))
 
 
-def week_heat_map_from_checkins(checkins, challenge_id, rule_set):
+def week_heat_map_from_checkins(
+    checkins, challenge_id, rule_set, names_and_tags=None, mulliganed=None, latest=None
+):
     heatmap_data = []
-    latest_date = None
-    latest_date = fetchone(
-        "select time at time zone 'America/New_York' from checkins order by time desc limit 1"
-    )
+    if latest is None:
+        latest = watermark.latest(challenge_id)
     checkins.sort(key=lambda x: x.name)
     weeks_grouped_by_name = {
         name: list(value)
         for name, value in itertools.groupby(checkins, key=lambda x: x.name)
     }
 
-    names_and_tags = get_challenger_info(challenge_id)
+    if names_and_tags is None:
+        names_and_tags = get_challenger_info(challenge_id)
     logging.info("Challengers and tags: %s", names_and_tags)
     names = [x.name for x in names_and_tags]
     tags = {x.name: x.tag for x in names_and_tags}
-    mulliganed = mulliganed_challengers(challenge_id)
+    if mulliganed is None:
+        mulliganed = mulliganed_challengers(challenge_id)
     logging.info("Challengers: %s", names)
     logging.info("Tags: %s", tags)
     logging.info("Mulliganed Challengers: %s", mulliganed)
@@ -449,7 +541,7 @@ def week_heat_map_from_checkins(checkins, challenge_id, rule_set):
         if name not in weeks_grouped_by_name:
             weeks_grouped_by_name[name] = []
 
-    latest = "00:00"
+    latest_hour = "00:00"
     earliest = "23:59"
     first_to_five = None
     highest_tier = (1, "")
@@ -488,8 +580,8 @@ def week_heat_map_from_checkins(checkins, challenge_id, rule_set):
             )
             time_hour = time.strftime("%H:%M") if time else None
             checked_in = bool(checkinIndex + 1)
-            if time_hour and time_hour > latest:
-                latest = time_hour
+            if time_hour and time_hour > latest_hour:
+                latest_hour = time_hour
             if time_hour and time_hour < earliest:
                 logging.info(
                     "time hour %s earliest %s checkin %s", time_hour, earliest, name
@@ -522,4 +614,4 @@ def week_heat_map_from_checkins(checkins, challenge_id, rule_set):
                 tags[name],
             )
         )
-    return heatmap_data, latest_date[0], (earliest, latest, first_to_five, highest_tier)
+    return heatmap_data, latest, (earliest, latest_hour, first_to_five, highest_tier)
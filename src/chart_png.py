@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import async_db
+import challenge_calendar
+import render_pool
+import watermark
+
+# (key, png) of the last chart rendered. One entry is enough: /chart only
+# ever shows the current week.
+_cached = None
+_building = {}
+
+
+def current():
+    """The current challenge and week, and the key their chart is cached by."""
+    challenge = challenge_calendar.current_challenge()
+    challenge_week = challenge_calendar.current_week()
+    key = (
+        challenge_week.id,
+        watermark.challenge(challenge.id).version,
+        watermark.challenges().version,
+        # possible check-ins so far move with the day
+        challenge_calendar.now().date(),
+    )
+    return challenge, challenge_week, key
+
+
+def chart_svg(challenge, challenge_week):
+    from chart import week_chart
+
+    return week_chart(challenge, challenge_week, challenge_week.id).svg
+
+
+async def render(key, challenge, challenge_week):
+    global _cached
+    try:
+        svg = await async_db.run(chart_svg, challenge, challenge_week)
+        png = await render_pool.render_png_async(svg)
+        _cached = (key, png)
+        return png
+    finally:
+        _building.pop(key, None)
+
+
+async def current_png():
+    """
+    The current week's chart as PNG bytes, rendered again only once the
+    week's data has moved. Callers arriving mid-render wait on that render.
+    """
+    challenge, challenge_week, key = await async_db.run(current)
+    cached = _cached
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    task = _building.get(key)
+    if task is None:
+        logging.info("Rendering chart for %s", key)
+        task = _building[key] = asyncio.ensure_future(
+            render(key, challenge, challenge_week)
+        )
+    # An interaction that gives up doesn't cancel the render for the rest.
+    return await asyncio.shield(task)
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+from datetime import timedelta
+
+from rq import Queue, Retry
+from valkey import Valkey
+
+import cache
+import challenge_calendar
+import medal_log
+import medals
+import outbox
+import week_snapshot
+
+# The rq Valkey. Check-in jobs run on their own queue so a slow cron job
+# never holds up medal announcements.
+RQ_URL = os.environ.get("RQ_URL", "redis://localhost:6379")
+QUEUE_NAME = "checkins"
+JOB_TIMEOUT_SECONDS = 120
+# Check-ins for a week that land this close together share one medal
+# recompute. Mornings bring bursts of them within seconds. Announcements
+# describe the medals as they stand after that recompute, so a medal one
+# check-in takes and the next takes back inside the window is never
+# announced.
+DEBOUNCE_SECONDS = float(os.environ.get("MEDAL_DEBOUNCE_SECONDS", 3))
+# A failed recompute is retried after each of these; after the last, its
+# check-ins wait for the next one the week schedules.
+RETRY_INTERVALS = [10, 60, 300]
+# Check-ins taken per recompute, the rest get a run of their own.
+BATCH_SIZE = 500
+PENDING_PREFIX = "checkin-medals:pending:"
+SCHEDULED_PREFIX = "checkin-medals:scheduled:"
+
+_queue = None
+
+
+def queue():
+    global _queue
+    if _queue is None:
+        _queue = Queue(QUEUE_NAME, connection=Valkey.from_url(RQ_URL))
+    return _queue
+
+
+def schedule(challenge_week_id):
+    """Queues a recompute for the week unless one is already waiting."""
+    q = queue()
+    # Lapses on its own if the job dies, so the week can't stay stuck.
+    if not q.connection.set(
+        SCHEDULED_PREFIX + str(challenge_week_id),
+        1,
+        nx=True,
+        ex=int(DEBOUNCE_SECONDS) + JOB_TIMEOUT_SECONDS,
+    ):
+        return None
+    return q.enqueue_in(
+        timedelta(seconds=DEBOUNCE_SECONDS),
+        process_week,
+        challenge_week_id,
+        job_timeout=JOB_TIMEOUT_SECONDS,
+        retry=Retry(max=len(RETRY_INTERVALS), interval=RETRY_INTERVALS),
+    )
+
+
+def enqueue(checkin_id, challenge_week_id, message_id=None):
+    """
+    Queues the slow part of a check-in. The check-in is already saved, so
+    a queue outage only costs the medals until the next check-in recomputes
+    them; it never fails the check-in. checkin_id is None for a change with
+    nothing to announce, like a removed check-in.
+    """
+    try:
+        queue().connection.sadd(
+            PENDING_PREFIX + str(challenge_week_id),
+            json.dumps([checkin_id, message_id]),
+        )
+        return schedule(challenge_week_id)
+    except Exception:
+        logging.exception("Couldn't queue medals for check-in %s", checkin_id)
+        return None
+
+
+def take_pending(challenge_week_id):
+    """
+    [(checkin_id, message_id)] waiting on the week, oldest check-in first
+    and removals, with no checkin_id, before them.
+    """
+    connection = queue().connection
+    # Cleared before taking the batch: a check-in landing from here on
+    # schedules the next run rather than waiting on this one.
+    connection.delete(SCHEDULED_PREFIX + str(challenge_week_id))
+    pending = connection.spop(PENDING_PREFIX + str(challenge_week_id), BATCH_SIZE)
+    if connection.scard(PENDING_PREFIX + str(challenge_week_id)):
+        schedule(challenge_week_id)
+    return sorted((tuple(json.loads(p)) for p in pending or []), key=lambda p: p[0] or 0)
+
+
+def put_back(challenge_week_id, pending):
+    """Returns a taken batch to the week, for a retry or the next run to pick up."""
+    queue().connection.sadd(
+        PENDING_PREFIX + str(challenge_week_id),
+        *[json.dumps([checkin_id, message_id]) for checkin_id, message_id in pending],
+    )
+
+
+def recompute(challenge_week, pending=()):
+    """
+    Recomputes the week's medals. Each pending check-in's announcement is
+    queued in the same transaction as its medals, so neither goes without
+    the other.
+    """
+
+    def announce_all(cur):
+        # Medals moving in a closed week, after a back-dated check-in or
+        # removal, would be hidden behind its snapshot.
+        week_snapshot.reopen_if_closed(cur, challenge_week)
+        log = medal_log.get_medal_log(challenge_week.id, cur=cur)
+        for checkin_id, message_id in pending:
+            relevant_medals = medal_log.medals_for_checkin(log, checkin_id)
+            logging.info("Medals for check-in %s: %s", checkin_id, relevant_medals)
+            if relevant_medals:
+                announce(relevant_medals, message_id, cur=cur)
+
+    medals.update_medal_table(
+        challenge_week.challenge_id, challenge_week.id, then=announce_all
+    )
+
+
+def announce(relevant_medals, message_id, cur=None):
+    """Queues the announcement, as a reply with the medal reactions for Discord check-ins."""
+    outbox.post(
+        medal_log.medal_announcement(relevant_medals),
+        reply_to=message_id,
+        reactions=[m.medal_emoji for m in relevant_medals],
+        cur=cur,
+    )
+
+
+def process_week(challenge_week_id):
+    """
+    rq job: one medal, score and chart recompute for every check-in the
+    week collected during the debounce window, with each check-in's own
+    announcement queued on the outbox.
+    """
+    pending = take_pending(challenge_week_id)
+    if not pending:
+        return
+    challenge_week = challenge_calendar.week_by_id(challenge_week_id)
+    if challenge_week is None:
+        logging.warning("No challenge week %s for check-ins %s", challenge_week_id, pending)
+        return
+    try:
+        recompute(challenge_week, pending)
+    except Exception:
+        # Medals and announcements commit together, so none of the batch
+        # went out.
+        put_back(challenge_week_id, pending)
+        raise
+    cache.invalidate_week(challenge_week)
+    logging.info("Recomputed medals for %s check-ins in week %s", len(pending), challenge_week_id)
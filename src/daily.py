@@ -0,0 +1,110 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Callable, List, NamedTuple, Optional
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+import challenge_calendar
+from helpers import connection_string
+
+
+class Step(NamedTuple):
+    name: str
+    fn: Callable
+    # 0 is Monday, None runs every day
+    weekday: Optional[int]
+
+
+class Timing(NamedTuple):
+    step: str
+    seconds: float
+    # "ok", "failed" or "skipped"
+    outcome: str
+
+
+STEPS: List[Step] = []
+
+
+def step(weekday=None):
+    """Registers fn(run) as the next step of the daily run."""
+
+    def register(fn):
+        STEPS.append(Step(fn.__name__, fn, weekday))
+        return fn
+
+    return register
+
+
+class Run:
+    """
+    What every step of one daily run shares: the connection, the time the
+    run started and the calendar as of then. Steps that change a week
+    update it here so the steps after them see the change.
+    """
+
+    def __init__(self, conn, at):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.at = at
+        self.today = at.date()
+        # Every challenge's running week, by date alone as auto-knockout
+        # has always picked them; challenge_week is the current week the
+        # rest of the app resolves.
+        self.weeks = challenge_calendar.running_weeks(at)
+        self.challenge_week = challenge_calendar.current_week(at)
+        yesterday = self.today - timedelta(days=1)
+        self.previous_weeks = [
+            w for w in challenge_calendar.calendar().weeks if w.end == yesterday
+        ]
+        self.timings = []
+        self._on_commit = []
+
+    def replace_week(self, challenge_week):
+        self.weeks = [
+            challenge_week if w.id == challenge_week.id else w for w in self.weeks
+        ]
+        if self.challenge_week is not None and self.challenge_week.id == challenge_week.id:
+            self.challenge_week = challenge_week
+
+    def on_commit(self, fn, *args):
+        """Runs fn once the current step's writes are committed."""
+        self._on_commit.append((fn, args))
+
+    def run_step(self, step):
+        if step.weekday is not None and self.today.weekday() != step.weekday:
+            self.timings.append(Timing(step.name, 0.0, "skipped"))
+            return
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            # Each step commits on its own, a failing one only loses its writes.
+            with self.conn.transaction():
+                step.fn(self)
+            for fn, args in self._on_commit:
+                fn(*args)
+        except Exception:
+            outcome = "failed"
+            logging.exception("Daily step %s failed", step.name)
+        finally:
+            self._on_commit = []
+        self.timings.append(Timing(step.name, time.perf_counter() - started, outcome))
+
+
+def run(steps=None, at=None):
+    """Runs the daily steps in order on one connection. Returns their timings."""
+    with psycopg.connect(
+        conninfo=connection_string, row_factory=namedtuple_row, autocommit=True
+    ) as conn:
+        daily = Run(conn, at or challenge_calendar.now())
+        for s in STEPS if steps is None else steps:
+            daily.run_step(s)
+    logging.info(
+        "Daily run: %s",
+        ", ".join(
+            "%s %s %.0fms" % (t.step, t.outcome, t.seconds * 1000)
+            for t in daily.timings
+        ),
+    )
+    return daily.timings
@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import logging
+import time
+
+# Discord's published per-channel limits: reactions one per quarter second,
+# messages five per five seconds. Pacing under them keeps bursts from
+# collecting 429s instead of waiting out each one.
+ROUTE_LIMITS = {
+    "reaction": (1, 0.25),
+    "message": (5, 5.0),
+}
+MAX_ATTEMPTS = 3
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__("rate limited for %ss" % retry_after)
+        self.retry_after = retry_after
+
+
+class Bucket:
+    """At most `limit` calls per `per` seconds, callers wait their turn."""
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.sent = collections.deque()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= self.per:
+                    self.sent.popleft()
+                wait = self.blocked_until - now
+                if len(self.sent) >= self.limit:
+                    wait = max(wait, self.per - (now - self.sent[0]))
+                if wait <= 0:
+                    self.sent.append(now)
+                    return
+                await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class DiscordHttp:
+    """The Discord calls the dispatcher makes, on a logged in bot."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def add_reaction(self, channel_id, message_id, emoji):
+        import discord
+
+        try:
+            await self.bot.http.add_reaction(channel_id, message_id, emoji)
+        except discord.HTTPException as e:
+            if e.status == 429:
+                raise RateLimited(float(e.response.headers.get("Retry-After", 1)))
+            raise
+
+    async def send_message(self, channel_id, content, reply_to=None, embed=None):
+        import discord
+
+        reference = None
+        if reply_to is not None:
+            reference = {
+                "message_id": reply_to,
+                "channel_id": channel_id,
+                "fail_if_not_exists": False,
+            }
+        try:
+            await self.bot.http.send_message(
+                channel_id, content, embed=embed, message_reference=reference
+            )
+        except discord.HTTPException as e:
+            if e.status == 429:
+                raise RateLimited(float(e.response.headers.get("Retry-After", 1)))
+            raise
+
+
+class Dispatcher:
+    """
+    Sends reactions and replies without awaiting each round trip in turn.
+    Calls for the same message run in the order they were asked for;
+    calls for different messages run concurrently, paced by their route's
+    bucket. Each call's task resolves to whether it went through; failures
+    are logged and never stop later calls.
+    """
+
+    def __init__(self, http):
+        self.http = http
+        self.buckets = {}
+        self.tails = {}
+        self.pending = set()
+
+    def bucket(self, route, channel_id):
+        key = (route, channel_id)
+        if key not in self.buckets:
+            self.buckets[key] = Bucket(*ROUTE_LIMITS[route])
+        return self.buckets[key]
+
+    async def call(self, route, channel_id, fn, *args):
+        bucket = self.bucket(route, channel_id)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await bucket.acquire()
+            try:
+                return await fn(*args)
+            except RateLimited as e:
+                logging.warning("Discord %s rate limited for %ss", route, e.retry_after)
+                bucket.block(e.retry_after)
+                if attempt == MAX_ATTEMPTS:
+                    raise
+
+    def submit(self, channel_id, message_id, route, fn, *args):
+        """Queues fn behind everything already queued for the message."""
+        key = (channel_id, message_id)
+        previous = self.tails.get(key)
+
+        async def run():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                await self.call(route, channel_id, fn, *args)
+                return True
+            except Exception:
+                logging.exception("Discord %s for message %s failed", route, message_id)
+                return False
+
+        task = asyncio.ensure_future(run())
+        self.tails[key] = task
+        self.pending.add(task)
+
+        def done(t):
+            self.pending.discard(t)
+            if self.tails.get(key) is t:
+                del self.tails[key]
+
+        task.add_done_callback(done)
+        return task
+
+    def react(self, channel_id, message_id, emojis):
+        """Adds the reactions in order."""
+        return [
+            self.submit(
+                channel_id,
+                message_id,
+                "reaction",
+                self.http.add_reaction,
+                channel_id,
+                message_id,
+                emoji,
+            )
+            for emoji in emojis
+        ]
+
+    def reply(self, channel_id, message_id, content, embed=None):
+        """Replies once the message's queued reactions are on."""
+        return self.submit(
+            channel_id,
+            message_id,
+            "message",
+            self.http.send_message,
+            channel_id,
+            content,
+            message_id,
+            embed,
+        )
+
+    def send(self, channel_id, content, embed=None):
+        return self.submit(
+            channel_id,
+            None,
+            "message",
+            self.http.send_message,
+            channel_id,
+            content,
+            None,
+            embed,
+        )
+
+    async def drain(self):
+        """Waits for everything queued so far."""
+        while self.pending:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
@@ -1,10 +1,11 @@
 from base_queries import get_current_challenge_week
 from helpers import fetchone, with_psycopg
+import cache
 import logging
 import random
 
 
-def number_of_non_green_weeks_before_this_one(challenge_id):
+def number_of_non_green_weeks_before_this_one(challenge_id, cur=None):
     sql = """
   select count(*) from challenge_weeks
        where
@@ -17,41 +18,48 @@ def number_of_non_green_weeks_before_this_one(challenge_id):
        /* the end is before now */
        and "end" < current_date
   """
-    return fetchone(sql, [challenge_id, challenge_id, challenge_id]).count
+    args = [challenge_id, challenge_id, challenge_id]
+    if cur is None:
+        return fetchone(sql, args).count
+    cur.execute(sql, args)
+    return cur.fetchone().count
 
 
-def determine_if_green():
-    challenge_week = get_current_challenge_week()
-
+def decide_green(cur, challenge_week):
+    """
+    Whether the week is green, deciding it on cur if nobody has yet.
+    Returns (green, changed); changed weeks need their caches invalidated
+    once cur's transaction commits.
+    """
     # If this is a bye week, set green to false and return
     if challenge_week.bye_week:
-        def set_green(conn, cur):
-            cur.execute(
-                "update challenge_weeks set green = false where id = %s",
-                [challenge_week.id],
-            )
-        with_psycopg(set_green)
-        return False
+        cur.execute(
+            "update challenge_weeks set green = false where id = %s",
+            [challenge_week.id],
+        )
+        return False, True
 
     if challenge_week.green is None:
-        
         num_non_green = number_of_non_green_weeks_before_this_one(
-            challenge_week.challenge_id
+            challenge_week.challenge_id, cur
         )
         logging.info(
             "there were %s weeks before this one that werent green", num_non_green
         )
         green = random.randint(0, 100) < 20 * num_non_green
         logging.debug("is is green %s", green)
+        cur.execute(
+            "update challenge_weeks set green = %s where id = %s",
+            [green, challenge_week.id],
+        )
+        return green, True
 
-        def set_green(conn, cur):
-            cur.execute(
-                "update challenge_weeks set green = %s where id = %s",
-                [green, challenge_week.id],
-            )
-
-        with_psycopg(set_green)
+    return challenge_week.green, False
 
-        return green
 
-    return challenge_week.green
+def determine_if_green():
+    challenge_week = get_current_challenge_week()
+    green, changed = with_psycopg(lambda conn, cur: decide_green(cur, challenge_week))
+    if changed:
+        cache.invalidate_week(challenge_week)
+    return green
@@ -0,0 +1,7 @@
+# Picked up by gunicorn from the working directory (see scripts/entrypoint).
+import change_feed
+
+
+def post_worker_init(worker):
+    # Each worker keeps its own listener, threads don't survive the fork.
+    change_feed.start()
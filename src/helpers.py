@@ -1,4 +1,5 @@
 import psycopg
+from contextlib import contextmanager
 from psycopg.rows import namedtuple_row
 import os
 import logging
@@ -33,3 +34,17 @@ def with_psycopg(fn):
     ) as conn:
         with conn.cursor() as cur:
             return fn(conn, cur)
+
+
+@contextmanager
+def advisory_lock(namespace, key):
+    """
+    Holds a Postgres session advisory lock on (namespace, key) across
+    processes for the body of the with block.
+    """
+    with psycopg.connect(conninfo=connection_string, autocommit=True) as conn:
+        conn.execute("select pg_advisory_lock(%s, %s)", [namespace, key])
+        try:
+            yield
+        finally:
+            conn.execute("select pg_advisory_unlock(%s, %s)", [namespace, key])
@@ -1,21 +1,39 @@
 import math
-import requests
 import os
 import itertools
 from datetime import datetime, timedelta, date
 import json
-from flask import Flask, render_template, request, url_for, redirect
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    render_template,
+    request,
+    send_from_directory,
+    url_for,
+    redirect,
+)
 import logging
-from rule_sets import calculate_total_score
-from chart import checkin_chart, diamond_week_holders, red_week_holders, week_heat_map_from_checkins, write_og_image
+import cache
+import watermark
+import single_flight
+import challenge_calendar
+import roster
+import payouts
+import checkin_jobs
+from page_cache import stale_while_revalidate
+from chart import week_chart, write_og_image
 import hashlib
 from helpers import fetchall, fetchone, with_psycopg
 from base_queries import *
 import re
 import pytz
 from twilio_decorator import twilio_request
-from cache_decorator import last_modified
+from cache_decorator import conditional, validator
 from green import determine_if_green
+from week_close import chart_rendered_at, stored_chart, stored_png
+from week_snapshot import is_closed, reopen_if_closed
 
 LOGLEVEL = os.environ.get("LOGLEVEL", "WARNING").upper()
 logging.basicConfig(level="DEBUG")
@@ -57,10 +75,68 @@ def version():
     )
 
 
+def today():
+    return datetime.now(tz=pytz.timezone("America/New_York")).date()
+
+
+def page_vary():
+    """What cached pages depend on besides their data: the build and the day."""
+    return get_version_number(), today()
+
+
+def page_validator(*parts, last_modified=None):
+    """
+    Validator for a page that also moves with the build and the day (weeks
+    so far, possible check-ins so far), on top of the data in parts.
+    """
+    now = datetime.now(tz=pytz.timezone("America/New_York"))
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if last_modified is None or last_modified < start_of_day:
+        last_modified = start_of_day
+    return validator(*page_vary(), *parts, last_modified=last_modified)
+
+
+def challenge_validator(challenge_id, *parts):
+    """
+    For pages drawn from the challenge, which also list every challenge.
+    Last-Modified follows the newest check-in, the ETag any data change.
+    """
+    marks = [watermark.challenge(challenge_id), watermark.challenges()]
+    return page_validator(
+        *parts,
+        *[m.version for m in marks],
+        last_modified=watermark.checkins(challenge_id).updated_at,
+    )
+
+
+def build_key(v):
+    """Identical builds share a validator, so its ETag keys single flight."""
+    return None if v is None else v.etag
+
+
+def details_tags():
+    challenge_id = request.args.get("challenge_id")
+    if challenge_id is None:
+        return None
+    return ["challenge:%s" % challenge_id, "challenges"]
+
+
+def details_validator():
+    challenge_id = request.args.get("challenge_id")
+    if challenge_id is None:
+        return None
+    return challenge_validator(challenge_id, request.full_path)
+
+
 @app.route("/details")
+@conditional(details_validator)
+@single_flight.coalesce(lambda: build_key(details_validator()))
+@cache.cached_view(details_tags, vary=page_vary)
 def details():
     challenge_id = request.args.get("challenge_id")
-    challenge = challenge_data(challenge_id)
+    challenge = challenge_calendar.challenge_by_id(challenge_id)
+    if challenge is None:
+        abort(404)
     logging.debug("Challenge ID: %s %s", challenge_id, challenge)
     weeksSinceStart = (
         min(
@@ -70,50 +146,33 @@ def details():
         - challenge.bi_weeks
     )
     logging.debug("Weeks since start: %s", weeksSinceStart)
-    points = points_so_far(challenge_id)
-    logging.info("points so far: %s", weeksSinceStart)
-    t3 = [x for x in points if x.tier == "T3"]
-    t3 = sorted(t3, key=lambda x: -x.points)
-    t2 = [x for x in points if x.tier == "T2"]
-    t2 = sorted(t2, key=lambda x: -x.points)
-    floating = [x for x in points if x.tier == "floating"]
-    floating = sorted(floating, key=lambda x: -x.points)
-    checkins_to_subtract = bi_checkins(challenge_id)
-    knocked_out = points_knocked_out(challenge_id)
-    total_points_t2 = sum(x.points for x in t2)
-    total_points_t3 = sum(x.points for x in t3)
-    total_points_floating = sum(x.points for x in floating) - checkins_to_subtract
-    ante_floating = total_ante(challenge_id, "floating")
-    ante_t2 = total_ante(challenge_id, "T2")
-    ante_t3 = total_ante(challenge_id, "T3")
-    dollars_per_point_floating = (
-        ante_floating / total_points_floating if total_points_floating > 0 else 0
-    )
-    dollars_per_point_t2 = ante_t2 / total_points_t2 if total_points_t2 > 0 else 0
-    dollars_per_point_t3 = ante_t3 / total_points_t3 if total_points_t3 > 0 else 0
-
-    points = sorted(points, key=lambda x: -x.points)
-    logging.debug("points: %s", points)
-    challenges = get_challenges()
+    challenge_payouts = payouts.for_challenge(challenge)
+    floating = challenge_payouts.tiers["floating"]
+    t2 = challenge_payouts.tiers["T2"]
+    t3 = challenge_payouts.tiers["T3"]
     return render_template(
         "details.html",
-        t2=t2,
-        t3=t3,
-        floating=floating,
-        total_points_t2=total_points_t2,
-        dollars_per_point_t2=dollars_per_point_t2,
-        total_ante_t2=int(dollars_per_point_t2 * total_points_t2),
-        total_points_t3=total_points_t3,
-        dollars_per_point_t3=dollars_per_point_t3,
-        total_ante_t3=int(dollars_per_point_t3 * total_points_t3),
-        total_points_floating=total_points_floating,
-        dollars_per_point_floating=dollars_per_point_floating,
-        total_ante_floating=int(dollars_per_point_floating * total_points_floating),
+        t2=t2.scores,
+        t3=t3.scores,
+        floating=floating.scores,
+        total_points_t2=t2.total_points,
+        dollars_per_point_t2=t2.dollars_per_point,
+        total_ante_t2=int(t2.dollars_per_point * t2.total_points),
+        total_points_t3=t3.total_points,
+        dollars_per_point_t3=t3.dollars_per_point,
+        total_ante_t3=int(t3.dollars_per_point * t3.total_points),
+        total_points_floating=floating.total_points,
+        dollars_per_point_floating=floating.dollars_per_point,
+        total_ante_floating=int(floating.dollars_per_point * floating.total_points),
         challenge=challenge,
-        knocked_out=knocked_out,
+        knocked_out=challenge_payouts.knocked_out,
         weeks=weeksSinceStart,
-        total_floating=total_points_floating,
-        challenges=[c for c in challenges if c.id not in set([1, challenge_id])],
+        total_floating=floating.total_points,
+        challenges=[
+            c
+            for c in challenge_calendar.calendar().challenges
+            if c.id not in set([1, challenge.id])
+        ],
     )
 
 
@@ -151,6 +210,7 @@ def create_challenge():
                 )
 
         with_psycopg(create)
+        cache.invalidate("challenges")
 
     challengers = fetchall(
         "select * from challengers where bmr is not null order by name"
@@ -158,34 +218,23 @@ def create_challenge():
     return render_template("create_challenge.html", challengers=challengers)
 
 
-@app.route("/")
-@last_modified(
-    "select time::TIMESTAMP as last_modified from checkins order by time desc limit 1"
-)
-def index():
+def index_selection():
+    """The challenge and week the index was asked for, resolved once per request."""
+    if "index_selection" in g:
+        return g.index_selection
+
     challenge_name = request.args.get("challenge")
     logging.debug("Challenge requested: %s", challenge_name)
     week_id = request.args.get("challenge_week_%s" % challenge_name)
     logging.debug("Week requested: %s", week_id)
-    now = datetime.now()
-    current_year = int(now.strftime("%Y"))
-    current_week = int(now.strftime("%W"))
-    current_date = date.today().isoformat()
 
     current_challenge = None
     if challenge_name is None:
-        logging.debug(
-            "Getting challenge for current week dates: %s %s %s",
-            current_year,
-            current_week,
-            current_date,
-        )
+        logging.debug("Getting challenge for current date: %s", date.today())
         current_challenge = get_current_challenge()
     else:
         logging.debug("Getting challenge with name: %s", challenge_name)
-        current_challenge = fetchone(
-            "select * from challenges where name = %s", [challenge_name]
-        )
+        current_challenge = challenge_calendar.challenge_by_name(challenge_name)
 
     logging.info("Current challenge: %s", current_challenge)
     current_challenge_week = get_current_challenge_week()
@@ -194,78 +243,192 @@ def index():
     if week_id is None:
         week_id = current_challenge_week.id
 
-    total_points = calculate_total_score(current_challenge.id)
-
-    logging.debug("Austin points: %s", total_points)
-
-    selected_challenge_week = fetchone(
-        "select * from challenge_weeks where id = %s", [week_id]
-    )
+    selected_challenge_week = challenge_calendar.week_by_id(week_id)
     logging.debug(
         "Selected challenge week: %s is green: %s",
         selected_challenge_week,
         selected_challenge_week.green,
     )
+    g.index_selection = (current_challenge, selected_challenge_week)
+    return g.index_selection
 
-    checkins = checkins_this_week(week_id)
-    logging.debug("Week checkins: %s", [checkin.name for checkin in checkins])
-    week, latest, achievements = week_heat_map_from_checkins(
-        checkins,
-        current_challenge.id,
-        current_challenge.rule_set,
-    )
-    week = sorted(
-        week, key=lambda x: -total_points[x.name] if x.name in total_points else 0
-    )
-    total_checkins = {x[1]: x[0] for x in points_so_far(current_challenge.id)}
-    logging.info("TOTAL CHECKINS %s", total_checkins)
-    logging.debug("WEEK: %s, LATEST: %s", week, latest)
-    chart = checkin_chart(
-        week,
-        1000,
-        600,
-        current_challenge.id,
-        selected_challenge_week.green,
-        selected_challenge_week.bye_week,
-        total_points,
-        achievements,
-        total_checkins,
-        total_possible_checkins(current_challenge.id)[0],
-        total_possible_checkins_so_far(current_challenge.id, current_challenge_week.id),
-        red_week_names=red_week_holders(week_id),
-        diamond_week_names=diamond_week_holders(week_id),
-    )
-    write_og_image(chart, week_id)
-    og_path = url_for("static", filename="preview-" + str(week_id) + ".png")
+
+def index_validator():
+    current_challenge, _ = index_selection()
+    return challenge_validator(current_challenge.id, request.full_path)
+
+
+def index_scopes():
+    current_challenge, _ = index_selection()
+    return [watermark.challenge_scope(current_challenge.id), watermark.CHALLENGES]
+
+
+@app.route("/")
+@stale_while_revalidate(index_scopes, vary=page_vary)
+@conditional(index_validator)
+@single_flight.coalesce(lambda: build_key(index_validator()))
+@cache.cached_view(
+    lambda: ["challenge:%s" % index_selection()[0].id, "challenges"], vary=page_vary
+)
+def index():
+    challenge_name = request.args.get("challenge")
+    now = datetime.now()
+    current_year = int(now.strftime("%Y"))
+    current_week = int(now.strftime("%W"))
+    current_challenge, selected_challenge_week = index_selection()
+    week_id = selected_challenge_week.id
+
+    latest = watermark.latest(current_challenge.id)
     logging.debug("Challenge ID: %s", current_challenge.id)
-    cws = challenge_weeks()
-    logging.debug("Weeks: %s", cws)
-    current_challenge_weeks = next(v for v in cws if v[0][0] == current_challenge.name)
-    logging.info("Current week index: %s, id: %s", current_challenge_weeks, week_id)
-
-    week_index = (
-        next(i for i, v in enumerate(current_challenge_weeks) if v[1] == int(week_id))
-        + 1
-    )
+    week_index = challenge_calendar.week_number(selected_challenge_week)
     logging.debug("Week Index: %s, Week ID: %s", week_index, week_id)
     return render_template(
         "index.html",
-        svg=chart,
+        chart_path=chart_url("week_chart_svg", selected_challenge_week),
         latest=latest,
         week=int(current_week),
         year=current_year,
         challenge_id=current_challenge.id,
-        og_path=og_path,
-        challenge_weeks=cws,
+        og_path=chart_url("week_chart_png", selected_challenge_week),
+        challenges=[
+            c
+            for c in reversed(challenge_calendar.calendar().challenges)
+            if challenge_calendar.challenge_weeks(c.id)
+        ],
+        challenge_weeks=challenge_calendar.challenge_weeks(current_challenge.id),
         current_challenge=current_challenge.name,
         current_week_index=week_index,
-        current_week_start=current_challenge_weeks[week_index - 1][2].strftime("%m/%d"),
+        current_week_start=selected_challenge_week.start.strftime("%m/%d"),
         current_week=current_week,
         viewing_this_week=challenge_name == request.args.get("challenge") == None,
         green=selected_challenge_week.green,
     )
 
 
+def weeks_validator(challenge_id):
+    challenges = watermark.challenges()
+    return page_validator(
+        "weeks", challenge_id, challenges.version, last_modified=challenges.updated_at
+    )
+
+
+@app.route("/challenges/<int:challenge_id>/weeks.json")
+@conditional(weeks_validator)
+def challenge_weeks_json(challenge_id):
+    """The week selector loads a challenge's weeks when it's picked."""
+    if challenge_calendar.challenge_by_id(challenge_id) is None:
+        abort(404)
+    return [
+        {
+            "id": w.id,
+            "number": challenge_calendar.week_number(w),
+            "start": w.start.strftime("%m/%d"),
+        }
+        for w in challenge_calendar.challenge_weeks(challenge_id)
+    ]
+
+
+# Open weeks change with every check-in so they keep the default no-cache,
+# which costs browsers a 304 when nothing moved. A closed week's chart is
+# only immutable at its versioned URL: a late write reopens the week and
+# it's drawn again at the same path.
+CLOSED_CHART_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def chart_version(rendered_at):
+    return str(int(rendered_at.timestamp()))
+
+
+def chart_url(endpoint, challenge_week):
+    """The week's chart URL, versioned by its stored chart once it has one."""
+    rendered_at = None
+    if is_closed(challenge_week):
+        rendered_at = chart_rendered_at(challenge_week.id)
+    if rendered_at is None:
+        return url_for(endpoint, week_id=challenge_week.id)
+    return url_for(endpoint, week_id=challenge_week.id, v=chart_version(rendered_at))
+
+
+def chart_selection(week_id):
+    """The week and its stored chart (closed weeks only), once per request."""
+    if "chart_selection" not in g:
+        challenge_week = challenge_calendar.week_by_id(week_id)
+        stored = None
+        if challenge_week is not None and is_closed(challenge_week):
+            stored = stored_chart(challenge_week.id)
+        g.chart_selection = (challenge_week, stored)
+    return g.chart_selection
+
+
+def chart_validator(week_id, kind):
+    """Validates the week's chart without drawing it."""
+    challenge_week, stored = chart_selection(week_id)
+    if challenge_week is None:
+        return None
+    if stored is not None:
+        versioned = request.args.get("v") == chart_version(stored.rendered_at)
+        return validator(
+            kind,
+            "closed",
+            challenge_week.id,
+            stored.rendered_at,
+            last_modified=stored.rendered_at,
+            # an unversioned or outdated URL revalidates like an open week's
+            cache_control=CLOSED_CHART_CACHE_CONTROL if versioned else "no-cache",
+        )
+
+    # totals span the whole challenge so any change in it redraws the week
+    return challenge_validator(challenge_week.challenge_id, kind, challenge_week.id)
+
+
+def chart_tags(week_id):
+    challenge_week, stored = chart_selection(week_id)
+    if challenge_week is None or stored is not None:
+        return None
+    return ["challenge:%s" % challenge_week.challenge_id, "week:%s" % challenge_week.id]
+
+
+def week_svg(challenge_week, stored):
+    if stored is not None:
+        return stored.svg
+    challenge = challenge_data(challenge_week.challenge_id)
+    current_challenge_week = get_current_challenge_week()
+    return week_chart(
+        challenge,
+        challenge_week,
+        current_challenge_week.id if current_challenge_week else challenge_week.id,
+    ).svg
+
+
+@app.route("/chart/<int:week_id>.svg")
+@conditional(lambda week_id: chart_validator(week_id, "svg"))
+@single_flight.coalesce(lambda week_id: build_key(chart_validator(week_id, "svg")))
+@cache.cached_view(chart_tags, vary=page_vary)
+def week_chart_svg(week_id):
+    challenge_week, stored = chart_selection(week_id)
+    if challenge_week is None:
+        abort(404)
+    return Response(week_svg(challenge_week, stored), mimetype="image/svg+xml")
+
+
+@app.route("/chart/<int:week_id>.png")
+@conditional(lambda week_id: chart_validator(week_id, "png"))
+def week_chart_png(week_id):
+    challenge_week, stored = chart_selection(week_id)
+    if challenge_week is None:
+        abort(404)
+
+    if stored is not None:
+        return Response(bytes(stored_png(week_id).png), mimetype="image/png")
+    og_image_file = single_flight.run(
+        "og:%s" % build_key(chart_validator(week_id, "png")),
+        lambda: write_og_image(week_svg(challenge_week, stored)),
+    )
+    if og_image_file is None:
+        abort(503)
+    return send_from_directory(app.static_folder, og_image_file, conditional=False)
+
+
 @app.route("/make-it-green")
 def make_it_green():
     green = determine_if_green()
@@ -277,7 +440,15 @@ def magic():
     return render_template("magic.html")
 
 
+def challenger_validator(challenger):
+    state = challenger_state(challenger)
+    if state is None:
+        return None
+    return validator(get_version_number(), state.state)
+
+
 @app.route("/challenger/<challenger>", methods=["GET", "POST"])
+@conditional(challenger_validator)
 def challenger(challenger):
     if "timezone" in request.form:
         timezone = request.form["timezone"]
@@ -288,18 +459,21 @@ def challenger(challenger):
             )
 
         with_psycopg(fn)
-    c = fetchone("select * from challengers where name = %s", [challenger])
-    m = fetchone(
-        'select cc.mulligan from challenger_challenges cc join challenges c on c.id = cc.challenge_id and c.start <= CURRENT_DATE and c."end" >= CURRENT_DATE where cc.challenger_id = %s',
-        [c.id],
+        roster.forget()
+    c = roster.by_name(challenger)
+    mulliganed = any(
+        m.mulligan is not None
+        for current in challenge_calendar.challenges_at()
+        for m in roster.members(current.id)
+        if m.challenger_id == c.id
     )
-    logging.info("Challenger: %s, mulligan: %s", c.name, m)
+    logging.info("Challenger: %s, mulligan: %s", c.name, mulliganed)
     return render_template(
         "challenger.html",
         name=challenger,
         bmr=c.bmr,
         timezone=c.tz,
-        mulliganed=(m.mulligan != None),
+        mulliganed=mulliganed,
     )
 
 
@@ -319,15 +493,10 @@ def add_checkin():
     tier = request.form["tier"]
     time = datetime.fromisoformat(request.form["time"])
     day_of_week = time.strftime("%A")
-    challenger = fetchone("select * from challengers where name = %s", [name])
-    challenge_week_during_sql = """
-        select * from challenge_weeks 
-        where 
-            week_of_year = extract(week from %s at time zone 'America/New_York') and
-            (%s at time zone 'America/New_York')::DATE >= start and
-            (%s at time zone 'America/New_York')::DATE <= "end";
-        """
-    challenge_week = fetchone(challenge_week_during_sql, (time, time, time))
+    challenger = roster.by_name(name)
+    challenge_week = get_current_challenge_week_for(
+        challenger, time, tz="America/New_York"
+    )
     logging.debug(
         "Add checkin: %s",
         {
@@ -339,16 +508,25 @@ def add_checkin():
             "challenge_week": challenge_week.id,
         },
     )
-    with_psycopg(
-        insert_checkin(
-            message=("%s checkin via magic" % tier),
-            tier=("T%s" % tier),
-            challenger=challenger,
-            week_id=challenge_week.id,
-            day_of_week=day_of_week,
-            time=time,
-        )
+    insert = insert_checkin(
+        message=("%s checkin via magic" % tier),
+        tier=("T%s" % tier),
+        challenger=challenger,
+        week_id=challenge_week.id,
+        day_of_week=day_of_week,
+        time=time,
     )
+
+    def fn(conn, cur):
+        checkin_id = insert(conn, cur)
+        # A back-dated check-in would be hidden behind the week's frozen
+        # rows; reopen the week so it's read live again.
+        reopen_if_closed(cur, challenge_week)
+        return checkin_id
+
+    checkin_id = with_psycopg(fn)
+    cache.invalidate_week(challenge_week)
+    checkin_jobs.enqueue(checkin_id, challenge_week.id)
     return render_template("magic.html")
 
 
@@ -431,16 +609,17 @@ def mail():
         logging.info("MAIL: unknown tier")
         return "5", 200
 
-    challenger = fetchone(
-        "select * from challengers where phone_number = %s and email_domain = %s",
-        (number, domain),
-    )
-    challenge_week = get_current_challenge_week(challenger.tz)
+    challenger = roster.by_email(number, domain)
+    challenge_week = get_current_challenge_week_for(challenger)
 
     logging.info("MAIL: challenger %s", challenger)
     logging.info("MAIL: challenge week %s", challenge_week.id)
 
-    with_psycopg(insert_checkin(message, tier, challenger, challenge_week.id))
+    checkin_id = with_psycopg(
+        insert_checkin(message, tier, challenger, challenge_week.id)
+    )
+    cache.invalidate_week(challenge_week)
+    checkin_jobs.enqueue(checkin_id, challenge_week.id)
 
     return "success", 200
 
@@ -465,25 +644,25 @@ def sms():
         logging.info("SMS: unknown tier")
         return "5", 200
 
-    challenger = fetchone(
-        "select * from challengers where phone_number = %s or phone_number = %s",
-        # check vs +1 and no +1
-        (phone_number, phone_number[2:]),
-    )
-    challenge_week = get_current_challenge_week(challenger.tz)
+    challenger = roster.by_phone(phone_number)
+    challenge_week = get_current_challenge_week_for(challenger)
 
     logging.info("SMS: challenger %s", challenger)
     logging.info("SMS: challenge week %s", challenge_week.id)
 
-    with_psycopg(insert_checkin(message, tier, challenger, challenge_week.id))
+    checkin_id = with_psycopg(
+        insert_checkin(message, tier, challenger, challenge_week.id)
+    )
+    cache.invalidate_week(challenge_week)
+    checkin_jobs.enqueue(checkin_id, challenge_week.id)
 
     return "success", 200
 
 
 @app.route("/mulligan/<challenger>", methods=["GET", "POST"])
 def mulligan(challenger):
-    c = fetchone("select * from challengers where name = %s", [challenger])
-    challenge_week = get_current_challenge_week(c.tz)
+    c = roster.by_name(challenger)
+    challenge_week = get_current_challenge_week_for(c)
 
     def insert_checkin_and_associate_mulligan(conn, cur):
         m = insert_checkin("MULLIGAN T1 checkin", "T1", c, challenge_week.id)(conn, cur)
@@ -494,6 +673,8 @@ def mulligan(challenger):
         )
 
     with_psycopg(insert_checkin_and_associate_mulligan)
+    cache.invalidate_week(challenge_week)
+    roster.forget()
     return render_template("mulligan.html", challenger=c)
 
 
@@ -1,8 +1,11 @@
+import logging
+from collections import defaultdict
+
 from helpers import fetchall
+from medals import nice_medal_names
 
 
-def get_medal_log(challenge_week_id):
-    sql = """
+MEDAL_LOG_SQL = """
 SELECT
      m.medal AS medal_name,
      m.emoji AS medal_emoji,
@@ -29,4 +32,89 @@ SELECT
  ORDER BY
      m.created_at;
 """
-    return fetchall(sql, [challenge_week_id])
+
+
+def get_medal_log(challenge_week_id, cur=None):
+    """The week's medals oldest first, read on cur when given."""
+    if cur is None:
+        return fetchall(MEDAL_LOG_SQL, [challenge_week_id])
+    cur.execute(MEDAL_LOG_SQL, [challenge_week_id])
+    return cur.fetchall()
+
+
+def describe_medal(medal_name):
+    fallback = medal_name.replace("_", " ").replace("  ", " ").title()
+    return nice_medal_names.get(medal_name, fallback)
+
+
+def medals_for_checkin(log, checkin_id):
+    return [medal for medal in log if medal.checkin_id == checkin_id]
+
+
+def medal_announcement(relevant_medals):
+    """
+    The message announcing a check-in's medals, grouped by who earned,
+    stole or kept them. Empty when there's nothing to announce.
+    """
+    # Group medals by user, action type, and (for steals) the person they stole from
+    grouped_medals = defaultdict(list)
+
+    for medal in relevant_medals:
+        nice_name = describe_medal(medal.medal_name)
+        emoji = medal.medal_emoji or ""
+        medal_display = f"{emoji} __**{nice_name}**__".strip()
+
+        # Check if this medal was stolen (has a previous holder)
+        if medal.stolen_checkin_challenger_name and medal.stolen_discord_id is not None:
+            if medal.discord_id == medal.stolen_discord_id:
+                # Special case: still holds and surpassed their own record
+                key = (medal.discord_id, "still_holds", None)
+            else:
+                # Stolen from someone else
+                key = (medal.discord_id, "stole", medal.stolen_discord_id)
+        else:
+            # Earned (no previous holder or invalid steal data)
+            key = (medal.discord_id, "earned", None)
+
+        grouped_medals[key].append(medal_display)
+
+    # Format grouped messages
+    # Sort so earned messages come before stolen/still_holds messages
+    def sort_key(item):
+        (discord_id, action_type, stolen_discord_id), medal_list = item
+        # Return 0 for "earned", 1 for others to ensure earned comes first
+        return (0 if action_type == "earned" else 1, discord_id, action_type, stolen_discord_id or "")
+
+    medal_message = ""
+    for (discord_id, action_type, stolen_discord_id), medal_list in sorted(grouped_medals.items(), key=sort_key):
+        # Format medal list with commas and "and"
+        if len(medal_list) == 1:
+            medals_text = medal_list[0]
+        elif len(medal_list) == 2:
+            medals_text = f"{medal_list[0]} and {medal_list[1]}"
+        else:
+            medals_text = ", ".join(medal_list[:-1]) + f", and {medal_list[-1]}"
+
+        if action_type == "still_holds":
+            pronoun = "them" if len(medal_list) > 1 else "it"
+            medal_message += (
+                f"\n\n<@{discord_id}> still holds {medals_text}, and has now surpassed {pronoun}!"
+            )
+        elif action_type == "stole":
+            # Validate stolen_discord_id to prevent invalid mentions
+            if stolen_discord_id is not None:
+                medal_message += (
+                    f"\n\n<@{discord_id}> stole {medals_text} from <@{stolen_discord_id}>!"
+                )
+            else:
+                # Fallback if stolen_discord_id is None (shouldn't happen, but safety check)
+                logging.warning(f"stolen_discord_id is None for steal action by {discord_id}")
+                medal_message += (
+                    f"\n\n<@{discord_id}> stole {medals_text}!"
+                )
+        else:  # earned
+            medal_message += (
+                f"\n\n<@{discord_id}> earned {medals_text}!"
+            )
+
+    return medal_message
@@ -1,4 +1,5 @@
 from helpers import *
+import cache
 import logging
 
 # Podium emoji constants
@@ -59,10 +60,16 @@ def get_medals_now(challenge_id, challenge_week_id):
     return reconcile_medals(new, current)
 
 
-def update_medal_table(challenge_id, challenge_week_id):
-    medals = get_medals_now(challenge_id, challenge_week_id)
-    logging.info("inserting medals %s", medals)
-    insert_medals(medals, challenge_id)
+# Advisory lock namespace for medal recomputes. Challenge medals move with
+# every week, so recomputes for the same challenge take turns.
+MEDALS_LOCK = 4201
+
+
+def update_medal_table(challenge_id, challenge_week_id, then=None):
+    with advisory_lock(MEDALS_LOCK, int(challenge_id)):
+        medals = get_medals_now(challenge_id, challenge_week_id)
+        logging.info("inserting medals %s", medals)
+        insert_medals(medals, challenge_id, then=then)
 
 
 def all_medals(challenge_id, challenge_week_id):
@@ -130,7 +137,8 @@ WITH ranked_medals AS (
     )  # , "challenge_week_id": challenge_week_id})
 
 
-def insert_medals(medals, challenge_id):
+def insert_medals(medals, challenge_id, then=None):
+    """then(cur), when given, runs in the insert's transaction."""
     sql = """
 insert into medals
     (challenger_id, medal, challenge_id, challenge_week_id, checkin_id, steal, emoji)
@@ -154,8 +162,14 @@ insert into medals
                 for m in medals
             ],
         )
+        if then is not None:
+            then(curr)
 
     with_psycopg(insert_all_medals)
+    cache.invalidate(
+        "challenge:%s" % challenge_id,
+        *{"week:%s" % m["challenge_week_id"] for m in medals},
+    )
 
 
 def reconcile_medals(new_medals, current_medals):
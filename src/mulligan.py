@@ -1,5 +1,9 @@
 from helpers import fetchall, with_psycopg
 from base_queries import insert_checkin
+import cache
+import challenge_calendar
+import roster
+import week_snapshot
 import datetime
 import logging
 import pytz
@@ -129,5 +133,11 @@ def insert_mulligan_for(name, challenge_week_id):
             "update challenger_challenges set mulligan = %s where challenger_id = %s and challenge_id = %s",
             [m, challenger.id, challenge_week.challenge_id],
         )
+        # The week is usually over by now and may be closed already.
+        closing_week = challenge_calendar.week_by_id(challenge_week.id)
+        if closing_week is not None:
+            week_snapshot.reopen_if_closed(cur, closing_week)
 
     with_psycopg(insert_checkin_and_associate_mulligan)
+    cache.invalidate_week(challenge_week)
+    roster.forget()
@@ -0,0 +1,109 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from render_pool import render_png
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+OG_IMAGE_SUBDIR = "og"
+OG_IMAGE_DIR = os.path.join(STATIC_DIR, OG_IMAGE_SUBDIR)
+# Previews are cheap to re-render, so keep the directory small and let the
+# least recently served images fall out first.
+OG_IMAGE_BUDGET_BYTES = int(os.environ.get("OG_IMAGE_BUDGET_BYTES", 25 * 1024 * 1024))
+
+
+def svg_digest(svg):
+    return hashlib.sha256(svg.encode("utf-8")).hexdigest()[:32]
+
+
+def static_filename(digest):
+    """Path of the preview relative to the static folder, for url_for."""
+    return "%s/%s.png" % (OG_IMAGE_SUBDIR, digest)
+
+
+@contextmanager
+def render_lock(directory, digest):
+    """
+    Cross-process lock so only one gunicorn worker renders a given digest.
+    Locks are striped on the digest prefix so the lock files never need
+    cleaning up.
+    """
+    lock_dir = os.path.join(directory, ".locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, digest[:2]), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".png")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(directory, budget_bytes, keep=None):
+    """Drop the least recently used previews until the directory fits the budget."""
+    entries = []
+    for entry in os.scandir(directory):
+        if not entry.is_file() or not entry.name.endswith(".png"):
+            continue
+        if entry.name.startswith(".tmp-"):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+            total -= size
+            logging.info("Evicted og image %s", path)
+        except FileNotFoundError:
+            pass
+
+
+def ensure_png(svg, directory=OG_IMAGE_DIR, budget_bytes=OG_IMAGE_BUDGET_BYTES, render=render_png):
+    """
+    Returns the digest of the PNG for svg, rendering it only if no image for
+    that exact svg exists yet. Every hit refreshes the file's mtime which is
+    what the LRU eviction orders by.
+    """
+    digest = svg_digest(svg)
+    path = os.path.join(directory, digest + ".png")
+    if os.path.exists(path):
+        touch(path)
+        return digest
+
+    os.makedirs(directory, exist_ok=True)
+    with render_lock(directory, digest):
+        # Another worker may have finished the render while we waited.
+        if os.path.exists(path):
+            touch(path)
+            return digest
+        atomic_write(path, render(svg))
+        logging.info("Rendered og image %s", path)
+
+    evict(directory, budget_bytes, keep=path)
+    return digest
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+
+import async_db
+from helpers import fetchall, with_psycopg
+
+DISCORD_CHANNEL_ID = os.environ.get("ALLOWED_MESSAGE_CHANNEL_ID")
+# How often the bot looks for new rows. The index only covers unsent
+# rows, so an idle check is next to free.
+POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", 1))
+BATCH_SIZE = 50
+# Discord rejects message content longer than this.
+MAX_LENGTH = 2000
+# Failed rows wait 2^attempts seconds before the next try, up to an hour.
+MAX_BACKOFF_SECONDS = 3600
+# Past this many failed tries a row is given up on, about four hours in.
+# Discord won't take a message to a deleted channel or a bad payload
+# however often it's retried.
+MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 15))
+
+
+def post(content=None, embed=None, reply_to=None, reactions=(), channel_id=None, cur=None):
+    """
+    Queues a message for the bot to send. Returns its outbox id. Pass the
+    cursor of the transaction making the change the message is about, so
+    the message is only queued if that change commits.
+    """
+
+    def fn(conn, cur):
+        cur.execute(
+            """
+            insert into discord_outbox (channel_id, content, embed, reply_to, reactions)
+            values (%s, %s, %s, %s, %s)
+            returning id
+            """,
+            [
+                int(channel_id or DISCORD_CHANNEL_ID),
+                content,
+                json.dumps(embed) if embed else None,
+                reply_to,
+                list(reactions),
+            ],
+        )
+        return cur.fetchone().id
+
+    if cur is not None:
+        return fn(None, cur)
+    return with_psycopg(fn)
+
+
+def unsent(limit=BATCH_SIZE):
+    return fetchall(
+        """
+        select * from discord_outbox
+        where sent_at is null and failed_at is null and next_attempt_at <= now()
+        order by id limit %s
+        """,
+        [limit],
+    )
+
+
+def mark_sent(ids):
+    def fn(conn, cur):
+        cur.execute(
+            "update discord_outbox set sent_at = now() where id = any(%s)", [list(ids)]
+        )
+
+    with_psycopg(fn)
+
+
+def mark_failed(ids, error, delivered_chunks=()):
+    """
+    Puts the rows back for a later batch, further off each time they fail,
+    or gives up on them at MAX_ATTEMPTS: failed_at is set and they're never
+    tried again. delivered_chunks are the pieces of a split message that
+    did go out. Returns the ids given up on.
+    """
+
+    def fn(conn, cur):
+        cur.execute(
+            """
+            update discord_outbox
+            set attempts = attempts + 1,
+                last_error = %s,
+                delivered_chunks = %s,
+                next_attempt_at = now()
+                    + least(power(2, attempts), %s) * interval '1 second',
+                failed_at = case when attempts + 1 >= %s then now() end
+            where id = any(%s)
+            returning id, failed_at
+            """,
+            [error, sorted(delivered_chunks), MAX_BACKOFF_SECONDS, MAX_ATTEMPTS, list(ids)],
+        )
+        return [r.id for r in cur.fetchall() if r.failed_at is not None]
+
+    given_up = with_psycopg(fn)
+    if given_up:
+        logging.error(
+            "Gave up on Discord outbox rows %s after %s attempts: %s",
+            given_up,
+            MAX_ATTEMPTS,
+            error,
+        )
+    return given_up
+
+
+def split(content, limit=MAX_LENGTH):
+    """Content cut into pieces Discord accepts, at a line or word break where there is one."""
+    chunks = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = content.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip("\n ")
+    if content or not chunks:
+        chunks.append(content)
+    return chunks
+
+
+def plain(row):
+    return row.reply_to is None and row.embed is None and row.content
+
+
+def plan(rows, limit=MAX_LENGTH):
+    """
+    The messages to send for a batch, in order, as dicts with the outbox
+    ids each one covers. Back to back plain messages to the same channel
+    are merged while they fit in one message; long ones are split. Replies
+    and embeds always go out on their own. Merged messages are one piece,
+    so only a split row ever has pieces already delivered.
+    """
+    envelopes = []
+    for row in rows:
+        last = envelopes[-1] if envelopes else None
+        if (
+            plain(row)
+            and last is not None
+            and last["mergeable"]
+            and last["channel_id"] == row.channel_id
+            and len(last["content"]) + 2 + len(row.content) <= limit
+        ):
+            last["ids"].append(row.id)
+            last["content"] += "\n\n" + row.content
+            continue
+        envelopes.append(
+            {
+                "ids": [row.id],
+                "channel_id": row.channel_id,
+                "content": row.content or "",
+                "embed": row.embed,
+                "reply_to": row.reply_to,
+                "reactions": row.reactions,
+                "delivered": set(row.delivered_chunks),
+                "mergeable": bool(plain(row)) and len(row.content) <= limit,
+            }
+        )
+    for envelope in envelopes:
+        envelope["chunks"] = split(envelope.pop("content"), limit)
+        del envelope["mergeable"]
+    return envelopes
+
+
+async def deliver(dispatcher, envelope):
+    """
+    Sends the pieces of one planned message not already delivered, and
+    returns the indexes of every piece that is out. Reactions are best
+    effort. The pieces are queued together so another message can't land
+    between them; an embed rides on the last one.
+    """
+    channel_id = envelope["channel_id"]
+    reply_to = envelope["reply_to"]
+    delivered = set(envelope["delivered"])
+    if reply_to is not None and envelope["reactions"] and not delivered:
+        dispatcher.react(channel_id, reply_to, envelope["reactions"])
+    chunks = envelope["chunks"]
+    tasks = {}
+    for i, chunk in enumerate(chunks):
+        if i in delivered:
+            continue
+        embed = envelope["embed"] if i == len(chunks) - 1 else None
+        if reply_to is not None:
+            tasks[i] = dispatcher.reply(channel_id, reply_to, chunk or None, embed=embed)
+        else:
+            tasks[i] = dispatcher.send(channel_id, chunk or None, embed=embed)
+    results = await asyncio.gather(*tasks.values())
+    return delivered | {i for i, ok in zip(tasks, results) if ok}
+
+
+async def drain(dispatcher):
+    """Sends one batch of what's due, returns how many rows went out."""
+    rows = await async_db.run(unsent)
+    if not rows:
+        return 0
+    envelopes = plan(rows)
+    results = await asyncio.gather(*[deliver(dispatcher, e) for e in envelopes])
+    sent = []
+    for envelope, delivered in zip(envelopes, results):
+        if len(delivered) == len(envelope["chunks"]):
+            sent.extend(envelope["ids"])
+        else:
+            await async_db.run(mark_failed, envelope["ids"], "send failed", delivered)
+    if sent:
+        await async_db.run(mark_sent, sent)
+    return len(sent)
+
+
+async def run_sender(dispatcher):
+    """The bot's long running sender, started once it's connected."""
+    while True:
+        try:
+            await drain(dispatcher)
+        except Exception:
+            logging.exception("Couldn't drain the Discord outbox")
+        await asyncio.sleep(POLL_SECONDS)
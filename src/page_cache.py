@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+from functools import wraps
+from typing import NamedTuple, Tuple
+
+from flask import Response, current_app, make_response, request
+
+import watermark
+from cache_decorator import Validator, apply_validator, is_fresh, not_modified
+
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 256))
+
+
+class Page(NamedTuple):
+    body: bytes
+    mimetype: str
+    validator: Validator
+    scopes: Tuple[str, ...]
+    versions: Tuple[int, ...]
+    vary: tuple
+
+
+def versions(scopes):
+    return tuple(watermark.get(scope).version for scope in scopes)
+
+
+def stale_while_revalidate(scopes_fn, vary=lambda: ()):
+    """
+    Keeps the last good render of each path in memory and serves it
+    straight away, even when the database is slow or down. Once the
+    watermarks the page was drawn from move, or vary() does, the stale page
+    is still served while one background thread per path renders a new one.
+
+    scopes_fn runs in the request that rendered the page and returns the
+    watermark scopes it was drawn from.
+    """
+
+    def decorator(f):
+        pages = {}
+        refreshing = set()
+        lock = threading.Lock()
+
+        def render(*args, **kwargs):
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            scopes = tuple(scopes_fn())
+            page = Page(
+                response.get_data(),
+                response.mimetype,
+                Validator(
+                    response.get_etag()[0],
+                    response.last_modified,
+                    response.headers.get("Cache-Control", "no-cache"),
+                ),
+                scopes,
+                versions(scopes),
+                vary(),
+            )
+            with lock:
+                pages.pop(request.full_path, None)
+                pages[request.full_path] = page
+                while len(pages) > PAGE_CACHE_MAX_ENTRIES:
+                    del pages[next(iter(pages))]
+            return response
+
+        def refresh(app, path, args, kwargs):
+            try:
+                with app.test_request_context(path):
+                    render(*args, **kwargs)
+            except Exception:
+                logging.exception("Background refresh of %s failed", path)
+            finally:
+                with lock:
+                    refreshing.discard(path)
+
+        def serve(page):
+            if page.validator.etag is None:
+                return Response(page.body, mimetype=page.mimetype)
+            if is_fresh(page.validator):
+                return not_modified(page.validator)
+            return apply_validator(
+                Response(page.body, mimetype=page.mimetype), page.validator
+            )
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            path = request.full_path
+            page = pages.get(path)
+            if page is None:
+                return render(*args, **kwargs)
+
+            try:
+                stale = (versions(page.scopes), vary()) != (page.versions, page.vary)
+            except Exception:
+                logging.exception("Couldn't check %s, serving it stale", path)
+                stale = True
+            if stale:
+                with lock:
+                    start = path not in refreshing
+                    refreshing.add(path)
+                if start:
+                    threading.Thread(
+                        target=refresh,
+                        args=(current_app._get_current_object(), path, args, kwargs),
+                        name="refresh %s" % path,
+                        daemon=True,
+                    ).start()
+            return serve(page)
+
+        return decorated_function
+
+    return decorator
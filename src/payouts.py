@@ -0,0 +1,177 @@
+from datetime import datetime
+from typing import Dict, List, NamedTuple
+from zoneinfo import ZoneInfo
+import logging
+
+from cache import cached
+from helpers import fetchall, fetchone, with_psycopg
+
+TIERS = ["floating", "T2", "T3"]
+
+# Everything /details needs about a challenge's money in one round trip.
+PAYOUT_SQL = """
+select
+    coalesce(
+        (select jsonb_agg(s) from get_challenge_score(%(challenge_id)s, false) s),
+        '[]'
+    ) as scores,
+    coalesce(
+        (select jsonb_agg(s) from get_challenge_score(%(challenge_id)s, true) s),
+        '[]'
+    ) as knocked_out,
+    coalesce(
+        (
+            select jsonb_object_agg(tier, ante)
+            from (
+                select tier, sum(ante) as ante
+                from challenger_challenges
+                where challenge_id = %(challenge_id)s
+                group by tier
+            ) a
+        ),
+        '{}'
+    ) as antes,
+    (
+        select coalesce(sum(bi_checkins), 0)
+        from challenger_challenges
+        where challenge_id = %(challenge_id)s
+    ) as bi_checkins
+"""
+
+
+class Score(NamedTuple):
+    points: int
+    name: str
+    tier: str
+
+
+class Tier(NamedTuple):
+    scores: List[Score]
+    total_points: int
+    ante: float
+    dollars_per_point: float
+
+
+class Payouts(NamedTuple):
+    tiers: Dict[str, Tier]
+    knocked_out: List[Score]
+
+
+def summarize(row):
+    """Splits the payout row into tiers, best score first."""
+    scores = sorted(
+        (Score(s["points"], s["name"], s["tier"]) for s in row.scores),
+        key=lambda s: -s.points,
+    )
+    tiers = {}
+    for tier in TIERS:
+        tier_scores = [s for s in scores if s.tier == tier]
+        total_points = sum(s.points for s in tier_scores)
+        if tier == "floating":
+            # bi-weekly check-ins only ever count against the floating pot
+            total_points -= int(row.bi_checkins)
+        ante = float(row.antes.get(tier) or 0)
+        tiers[tier] = Tier(
+            tier_scores,
+            total_points,
+            ante,
+            ante / total_points if total_points > 0 else 0,
+        )
+    knocked_out = [Score(s["points"], s["name"], s["tier"]) for s in row.knocked_out]
+    return Payouts(tiers, knocked_out)
+
+
+def is_finished(challenge):
+    return challenge.end < datetime.now(tz=ZoneInfo("America/New_York")).date()
+
+
+def settled(challenge_id):
+    return fetchone(
+        "select scores, knocked_out, antes, bi_checkins from challenge_payouts where challenge_id = %s",
+        [challenge_id],
+    )
+
+
+def settle(challenge_id):
+    """
+    Freezes a finished challenge's payouts. The first snapshot wins, only
+    unsettle() makes way for another.
+    """
+
+    def fn(conn, cur):
+        cur.execute(
+            """
+            insert into challenge_payouts (challenge_id, scores, knocked_out, antes, bi_checkins)
+            select %(challenge_id)s, p.* from ("""
+            + PAYOUT_SQL
+            + """) p
+            on conflict (challenge_id) do nothing
+            returning scores, knocked_out, antes, bi_checkins
+            """,
+            {"challenge_id": challenge_id},
+        )
+        return cur.fetchone()
+
+    row = with_psycopg(fn)
+    logging.info(
+        "Payouts for challenge %s %s",
+        challenge_id,
+        "settled" if row is not None else "already settled",
+    )
+    return row or settled(challenge_id)
+
+
+def settle_finished():
+    """
+    Settles every finished challenge that isn't yet. Runs from the close
+    job, after the morning's auto-knockout reconciled the final week, so
+    its knockouts and mulligans are in the totals.
+    """
+    rows = fetchall(
+        """
+        select c.id from challenges c
+        left join challenge_payouts cp on cp.challenge_id = c.id
+        where
+            c."end" < (current_timestamp at time zone 'America/New_York')::date
+            and cp.challenge_id is null
+        order by c.id
+        """
+    )
+    for row in rows:
+        try:
+            settle(row.id)
+        except Exception:
+            logging.exception("Failed to settle payouts for challenge %s", row.id)
+
+
+def unsettle(cur, challenge_week_id):
+    """
+    Drops the payouts of the week's challenge on cur, for writes landing
+    after it finished. /details goes back to the live totals until the
+    close job settles it again.
+    """
+    cur.execute(
+        """
+        delete from challenge_payouts
+        where challenge_id = (select challenge_id from challenge_weeks where id = %s)
+        """,
+        [challenge_week_id],
+    )
+
+
+@cached("challenge:{challenge_id}")
+def live(challenge_id):
+    return summarize(fetchone(PAYOUT_SQL, {"challenge_id": challenge_id}))
+
+
+def for_challenge(challenge):
+    """
+    Settled challenges read their snapshot, the rest the live totals,
+    including finished ones the close job hasn't settled yet.
+    """
+    if not is_finished(challenge):
+        return live(challenge.id)
+    row = settled(challenge.id)
+    if row is None:
+        return live(challenge.id)
+    return summarize(row)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+# Jobs that are queued or running at once. Past this we refuse new work
+# rather than letting a burst pile up behind a slow render.
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", 8))
+RENDER_TIMEOUT_SECONDS = float(os.environ.get("RENDER_TIMEOUT_SECONDS", 20))
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+_executor = None
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(RENDER_QUEUE_SIZE)
+_in_flight = {}
+
+
+def svg_to_png(svg):
+    """Runs inside a pool process."""
+    import cairosvg
+
+    return cairosvg.svg2png(bytestring=svg.encode("utf-8"))
+
+
+class _Render(Future):
+    # The pool the job went to, so restarting it fails the right jobs.
+    pool = None
+
+
+def _new_executor():
+    # forkserver keeps the children clear of whatever threads the parent
+    # (gunicorn, the discord loop) happens to be running.
+    return ProcessPoolExecutor(
+        max_workers=RENDER_WORKERS,
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = _new_executor()
+        return _executor
+
+
+def restart(pool):
+    """
+    Throws pool away if it's still the current one: its workers are killed
+    and every job it holds fails with RenderTimeout, freeing their slots.
+    The next job starts a fresh pool. For a hung render, which would hold
+    its worker and slot for good, or a pool broken by a dead worker.
+    """
+    global _executor
+    with _lock:
+        if pool is None or _executor is not pool:
+            return
+        _executor = None
+        stranded = [f for f in _in_flight.values() if f.pool is pool]
+    logging.warning("Restarting the render pool, failing %s jobs", len(stranded))
+    # The processes go away on shutdown, take them first. Python 3.14 has
+    # terminate_workers() for this.
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for future in stranded:
+        if not future.done():
+            future.set_exception(RenderTimeout("render pool restarted"))
+
+
+def submit(fn, *args):
+    """
+    Queues fn(*args) on the pool. Identical jobs that are already queued or
+    running share the same future instead of being rendered twice.
+    """
+    key = (fn.__module__, fn.__qualname__, args)
+    with _lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        if not _slots.acquire(blocking=False):
+            raise RenderQueueFull("%s jobs already pending" % RENDER_QUEUE_SIZE)
+        # Stored before the job is handed to the pool so callers arriving
+        # in between share it too.
+        future = _in_flight[key] = _Render()
+
+    def done(_):
+        with _lock:
+            _in_flight.pop(key, None)
+        _slots.release()
+
+    future.add_done_callback(done)
+    try:
+        pool = executor()
+        try:
+            job = pool.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            # Broken, or shut down by a restart since we took it.
+            restart(pool)
+            pool = executor()
+            job = pool.submit(fn, *args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    future.pool = pool
+    job.add_done_callback(lambda job: _chain(job, future, pool))
+    return future
+
+
+def _chain(job, future, pool):
+    if job.cancelled():
+        if not future.done():
+            future.cancel()
+    elif job.exception() is not None:
+        if isinstance(job.exception(), BrokenProcessPool):
+            # A worker died; the pool takes no more work until it's replaced.
+            restart(pool)
+        if not future.done():
+            future.set_exception(job.exception())
+    elif not future.done():
+        future.set_result(job.result())
+
+
+def render(fn, *args, timeout=RENDER_TIMEOUT_SECONDS):
+    """
+    fn(*args) from the pool. A job still running after timeout restarts
+    the pool, so a hung render gives its worker and queue slot back; the
+    jobs it shared the pool with fail with RenderTimeout too.
+    """
+    future = submit(fn, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        logging.warning("Render %s timed out after %ss", fn.__qualname__, timeout)
+        restart(future.pool)
+        raise RenderTimeout(fn.__qualname__)
+
+
+async def render_async(fn, *args, timeout=RENDER_TIMEOUT_SECONDS):
+    """render for the event loop, timing out the same way."""
+    future = submit(fn, *args)
+    try:
+        # shield so a timed out waiter doesn't cancel the job for everyone
+        # else sharing it.
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), timeout
+        )
+    except asyncio.TimeoutError:
+        logging.warning("Render %s timed out after %ss", fn.__qualname__, timeout)
+        restart(future.pool)
+        raise RenderTimeout(fn.__qualname__)
+
+
+def render_png(svg, timeout=RENDER_TIMEOUT_SECONDS):
+    return render(svg_to_png, svg, timeout=timeout)
+
+
+async def render_png_async(svg, timeout=RENDER_TIMEOUT_SECONDS):
+    return await render_async(svg_to_png, svg, timeout=timeout)
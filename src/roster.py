@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Tuple
+
+import change_feed
+from helpers import fetchall
+
+# Without a change feed listener (rq jobs, scripts) reload this often.
+ROSTER_TTL_SECONDS = int(os.environ.get("ROSTER_TTL_SECONDS", 60))
+
+
+class Roster(NamedTuple):
+    by_id: Dict[int, object]
+    by_name: Dict[str, object]
+    by_discord_id: Dict[str, object]
+    by_phone: Dict[str, object]
+    by_email: Dict[Tuple[str, str], object]
+    # challenge id -> challenger_challenges rows joined with the name
+    members: Dict[int, List[object]]
+    loaded_at: float
+
+
+_roster = None
+_lock = threading.Lock()
+
+
+def load():
+    challengers = fetchall("select * from challengers order by name")
+    members = defaultdict(list)
+    for m in fetchall(
+        """
+        select cc.*, ch.name
+        from challenger_challenges cc
+        join challengers ch on ch.id = cc.challenger_id
+        order by ch.name
+        """
+    ):
+        members[m.challenge_id].append(m)
+    return Roster(
+        {c.id: c for c in challengers},
+        {c.name: c for c in challengers},
+        {c.discord_id: c for c in challengers if c.discord_id},
+        {c.phone_number: c for c in challengers if c.phone_number},
+        {
+            (c.phone_number, c.email_domain): c
+            for c in challengers
+            if c.phone_number and c.email_domain
+        },
+        dict(members),
+        time.monotonic(),
+    )
+
+
+def roster():
+    global _roster
+    current = _roster
+    if current is not None and (
+        change_feed.is_listening()
+        or time.monotonic() - current.loaded_at < ROSTER_TTL_SECONDS
+    ):
+        return current
+    with _lock:
+        if _roster is current:
+            _roster = load()
+        return _roster
+
+
+@change_feed.on_connect
+@change_feed.on_disconnect
+def forget():
+    """Call after writing challengers or challenger_challenges."""
+    global _roster
+    _roster = None
+
+
+@change_feed.subscribe
+def on_change(change):
+    if change.table in ("challengers", "challenger_challenges"):
+        forget()
+
+
+def by_id(challenger_id):
+    return roster().by_id.get(challenger_id)
+
+
+def by_name(name):
+    return roster().by_name.get(name)
+
+
+def by_discord_id(discord_id):
+    return roster().by_discord_id.get(str(discord_id))
+
+
+def by_phone(phone_number):
+    """Numbers are stored with or without the +1, so try both."""
+    index = roster().by_phone
+    return index.get(phone_number) or index.get(phone_number[2:])
+
+
+def by_email(phone_number, email_domain):
+    return roster().by_email.get((phone_number, email_domain))
+
+
+def members(challenge_id):
+    return roster().members.get(int(challenge_id), [])
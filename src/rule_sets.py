@@ -2,6 +2,7 @@ import itertools
 import os
 import logging
 from helpers import fetchall
+from cache import cached
 
 def score(tier, rule_set):
     if rule_set == 1:
@@ -33,7 +34,11 @@ def version_2_score(tier):
     return points
 
 
-def calculate_total_score(challenge_id):
+def scores_by_week(challenge_id):
+    """
+    Points per challenger for every week of the challenge that hasn't been
+    frozen into a week snapshot yet. Returns {challenge_week_id: {name: points}}.
+    """
     query = """
         select 
             Max(ltrim(checkins.tier, 'T')::INT) as max,
@@ -53,6 +58,10 @@ def calculate_total_score(challenge_id):
            and challenge_weeks.challenge_id = %s
            and challenges.id = %s
            and checkins.tier != 'T0'
+           and not exists (
+               select 1 from week_snapshots
+               where week_snapshots.challenge_week_id = challenge_weeks.id
+           )
         group by
             date(checkins.time at time zone 'America/New_York'),
             checkins.name,
@@ -74,23 +83,46 @@ def calculate_total_score(challenge_id):
         }
         for n in checkins_this_challenge
     ]
-    names = set(n["name"] for n in nums)
-    weeks = [list(week) for w, week in itertools.groupby(nums, key=lambda x: x["week"])]
-    num_weeks = len(list(weeks))
-    result = {
-        n: sum(
-            round(
+    return {
+        w: {
+            name: round(
                 sum(
                     sorted(
-                        (name["value"] for name in week if name["name"] == n),
+                        (n["value"] for n in week if n["name"] == name),
                         reverse=True,
                     )[:5]
                 ),
                 4,
             )
-            for week in weeks
+            for name in set(n["name"] for n in week)
+        }
+        for w, week in (
+            (w, list(week))
+            for w, week in itertools.groupby(nums, key=lambda x: x["week"])
         )
-        for n in names
     }
+
+
+def frozen_scores(challenge_id):
+    sql = """
+        select wsc.name, wsc.score
+        from week_snapshot_challengers wsc
+        join week_snapshots ws on ws.challenge_week_id = wsc.challenge_week_id
+        where
+            ws.challenge_id = %s
+            and wsc.score is not null
+        order by ws.challenge_week_id
+    """
+    return fetchall(sql, [challenge_id])
+
+
+@cached("challenge:{challenge_id}")
+def calculate_total_score(challenge_id):
+    result = {}
+    for row in frozen_scores(challenge_id):
+        result[row.name] = result.get(row.name, 0) + row.score
+    for week in scores_by_week(challenge_id).values():
+        for name, points in week.items():
+            result[name] = result.get(name, 0) + points
     logging.info("Total Points: %s", result)
     return result
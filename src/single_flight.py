@@ -0,0 +1,97 @@
+import logging
+import os
+import pickle
+import time
+import uuid
+from functools import wraps
+
+from flask import Response, make_response, request
+
+import cache
+
+# How long a leader may hold a build before others stop waiting on it.
+LOCK_SECONDS = int(os.environ.get("SINGLE_FLIGHT_LOCK_SECONDS", 30))
+# Results only need to outlive the burst that was waiting for them.
+RESULT_SECONDS = int(os.environ.get("SINGLE_FLIGHT_RESULT_SECONDS", 10))
+POLL_SECONDS = 0.05
+LOCK_PREFIX = "single-flight-lock:"
+RESULT_PREFIX = "single-flight-result:"
+
+
+def run(key, fn, *args, share=lambda result: result is not None):
+    """
+    Runs fn(*args) once among everyone asking for key at the same time,
+    across processes when the cache is shared. The leader's result is handed
+    to the callers that waited on it if share(result) allows, otherwise they
+    each take their turn as leader. key has to identify the data the build
+    reads, e.g. include its watermark, since a result outlives the build.
+    """
+    store = cache.backend()
+    lock_key = LOCK_PREFIX + key
+    result_key = RESULT_PREFIX + key
+    token = uuid.uuid4().hex.encode()
+    deadline = time.monotonic() + LOCK_SECONDS
+
+    while True:
+        try:
+            raw = store.get_many([result_key])[0]
+            if raw is not None:
+                return pickle.loads(raw)
+            leader = store.add(lock_key, token, LOCK_SECONDS)
+        except Exception:
+            logging.exception("Single flight unavailable for %s", key)
+            return fn(*args)
+
+        if leader:
+            try:
+                result = fn(*args)
+                if share(result):
+                    store.set(result_key, pickle.dumps(result), RESULT_SECONDS)
+                return result
+            finally:
+                try:
+                    store.delete_if(lock_key, token)
+                except Exception:
+                    logging.exception("Couldn't release single flight %s", key)
+
+        if time.monotonic() > deadline:
+            logging.warning("Gave up waiting on single flight %s", key)
+            return fn(*args)
+        time.sleep(POLL_SECONDS)
+
+
+def coalesce(key_fn):
+    """
+    Coalesces identical GET requests for a view. key_fn gets the view's
+    arguments and returns the build's key, or None to always run the view.
+    Only plain 200 responses are shared.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            key = key_fn(*args, **kwargs)
+            if key is None:
+                return f(*args, **kwargs)
+
+            def build():
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                return response.get_data(), response.mimetype
+
+            result = run(
+                "view:%s:%s" % (f.__name__, key),
+                build,
+                share=lambda r: isinstance(r, tuple),
+            )
+            if isinstance(result, Response):
+                return result
+            body, mimetype = result
+            return Response(body, mimetype=mimetype)
+
+        return decorated_function
+
+    return decorator
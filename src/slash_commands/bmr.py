@@ -1,6 +1,8 @@
 import discord
 from base_queries import challenger_by_discord_id, update_challenger_bmr
 from helpers import with_psycopg
+import async_db
+import roster
 
 INVALID_INPUT_MESSAGE = "Invalid input, please try again."
 
@@ -96,7 +98,10 @@ class BmrModal(discord.ui.DesignerModal):
         current_bmr = calculate_bmr(
             sex, weight_lbs, height_feet, height_inches, age_years
         )
-        with_psycopg(update_challenger_bmr(self.challenger.id, current_bmr))
+        await async_db.run(
+            with_psycopg, update_challenger_bmr(self.challenger.id, current_bmr)
+        )
+        roster.forget()
         await interaction.response.send_message(
             bmr_response_text(current_bmr, previous_bmr), ephemeral=True
         )
@@ -111,7 +116,7 @@ async def launch_bmr_modal(ctx: discord.ApplicationContext):
         )
         return
 
-    challenger = challenger_by_discord_id(str(user.id))
+    challenger = await async_db.run(challenger_by_discord_id, str(user.id))
     if challenger is None:
         await ctx.respond(
             "You are not registered as a challenger yet.",
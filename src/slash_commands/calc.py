@@ -3,6 +3,7 @@ import math
 from base_queries import challenger_by_discord_id, get_current_challenge
 from simpleeval import simple_eval
 from helpers import with_psycopg
+import async_db
 
 
 class Modal(discord.ui.Modal):
@@ -14,7 +15,7 @@ class Modal(discord.ui.Modal):
 
     async def callback(self, interaction: discord.Interaction):
         id = interaction.user.id
-        challenger = challenger_by_discord_id(str(id))
+        challenger = await async_db.run(challenger_by_discord_id, str(id))
 
         calories = simple_eval(self.children[0].value)
         time = simple_eval(self.children[1].value)
@@ -1,14 +1,17 @@
 import discord
 from base_queries import challenger_by_discord_id, get_current_challenge
 from helpers import with_psycopg
+import async_db
+import cache
+import roster
 
 
 class Button(discord.ui.View):
     @discord.ui.button(label="Yes, I am a quitter.", style=discord.ButtonStyle.primary)
     async def button_callback(self, button, interaction):
         id = interaction.user.id
-        challenger = challenger_by_discord_id(str(id))
-        current_challenge = get_current_challenge()
+        challenger = await async_db.run(challenger_by_discord_id, str(id))
+        current_challenge = await async_db.run(get_current_challenge)
         print(challenger)
         await interaction.message.delete()
 
@@ -26,4 +29,6 @@ class Button(discord.ui.View):
         await interaction.response.send_message(
             f"You have disappointed us all {challenger.name}"
         )
-        with_psycopg(remove_challenger)
+        await async_db.run(with_psycopg, remove_challenger)
+        await async_db.run(cache.invalidate, "challenge:%s" % current_challenge.id)
+        roster.forget()
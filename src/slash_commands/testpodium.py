@@ -5,6 +5,7 @@ from helpers import fetchone, fetchall
 from base_queries import get_challenges
 from medals import PODIUM_EMOJIS
 from rule_sets import calculate_total_score
+import roster
 
 
 def get_most_recently_ended_challenge():
@@ -50,14 +51,8 @@ def get_podium(challenge_id):
     if not total_points:
         return []
 
-    # Get all discord_ids in one query
-    unique_names = set(total_points.keys())
-    placeholders = ",".join(["%s"] * len(unique_names))
-    challengers = fetchall(
-        f"SELECT name, discord_id FROM challengers WHERE name IN ({placeholders})",
-        list(unique_names),
-    )
-    name_to_discord_id = {c.name: c.discord_id for c in challengers if c.discord_id}
+    challengers = [roster.by_name(name) for name in total_points]
+    name_to_discord_id = {c.name: c.discord_id for c in challengers if c and c.discord_id}
 
     # Sort by points and get top 3
     sorted_names = sorted(total_points.items(), key=lambda x: -x[1])[:3]
@@ -104,6 +99,40 @@ def get_final_medal_holders_per_week(challenge_id):
         JOIN challenge_weeks cw ON m.challenge_week_id = cw.id
         WHERE cw.challenge_id = %s
         AND (cw.bye_week != true OR cw.bye_week IS NULL)
+        -- closed weeks are read from their snapshot below
+        AND NOT EXISTS (
+            SELECT 1 FROM week_snapshots ws WHERE ws.challenge_week_id = cw.id
+        )
+    ),
+    final_medals AS (
+        SELECT
+            rm.medal AS medal_name,
+            rm.emoji AS medal_emoji,
+            rm.challenger_id,
+            rm.challenge_week_id,
+            rm.checkin_id,
+            ci.tier AS checkin_tier
+        FROM ranked_medals rm
+        LEFT JOIN checkins ci ON ci.id = rm.checkin_id
+        WHERE rm.rn = 1
+        UNION ALL
+        SELECT
+            fm.medal_name,
+            fm.medal_emoji,
+            fm.challenger_id,
+            ws.challenge_week_id,
+            fm.checkin_id,
+            fm.checkin_tier
+        FROM week_snapshots ws
+        CROSS JOIN jsonb_to_recordset(ws.medals) AS fm(
+            medal_name text,
+            medal_emoji text,
+            challenger_id integer,
+            checkin_id integer,
+            checkin_tier text
+        )
+        WHERE ws.challenge_id = %s
+        AND (ws.bye_week != true OR ws.bye_week IS NULL)
     ),
     numbered_weeks AS (
         SELECT 
@@ -118,22 +147,20 @@ def get_final_medal_holders_per_week(challenge_id):
         AND (bye_week != true OR bye_week IS NULL)
     )
     SELECT
-        rm.medal AS medal_name,
-        rm.emoji AS medal_emoji,
+        fm.medal_name,
+        fm.medal_emoji,
         c.name AS challenger_name,
         c.discord_id as discord_id,
-        rm.challenge_week_id,
-        rm.checkin_id,
-        ci.tier AS checkin_tier,
+        fm.challenge_week_id,
+        fm.checkin_id,
+        fm.checkin_tier,
         nw.week_number
-    FROM ranked_medals rm
-    JOIN challengers c ON c.id = rm.challenger_id
-    LEFT JOIN checkins ci ON ci.id = rm.checkin_id
-    JOIN numbered_weeks nw ON nw.id = rm.challenge_week_id
-    WHERE rm.rn = 1
-    ORDER BY rm.challenge_week_id, rm.medal;
+    FROM final_medals fm
+    JOIN challengers c ON c.id = fm.challenger_id
+    JOIN numbered_weeks nw ON nw.id = fm.challenge_week_id
+    ORDER BY fm.challenge_week_id, fm.medal_name;
     """
-    return fetchall(sql, [challenge_id, challenge_id])
+    return fetchall(sql, [challenge_id, challenge_id, challenge_id])
 
 
 def get_final_medal_holders_challenge_wide(challenge_id):
@@ -0,0 +1,15 @@
+-- Scores and antes of a finished challenge, written by payouts.settle from
+-- the close job once the final week is reconciled. Rows are never updated;
+-- a write into one of the challenge's weeks deletes the row
+-- (payouts.unsettle) and the next close job settles it again.
+create table if not exists challenge_payouts (
+  challenge_id integer primary key references challenges (id),
+  -- get_challenge_score(challenge_id, false): [{points, name, tier}]
+  scores jsonb not null,
+  -- get_challenge_score(challenge_id, true)
+  knocked_out jsonb not null,
+  -- tier -> summed ante
+  antes jsonb not null,
+  bi_checkins numeric not null,
+  settled_at timestamptz not null default now()
+);
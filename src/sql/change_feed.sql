@@ -0,0 +1,152 @@
+-- Sends a 'data_changed' notification with the ids a change touches so
+-- every process can drop what it cached from them (see change_feed.py),
+-- and bumps the data_versions of those scopes (see data_versions.sql).
+-- Notifications go out on commit.
+
+-- The ids one changed row touches, as the notification carries them.
+create or replace function data_change_payload(table_name text, r jsonb) returns jsonb
+language sql stable as $$
+  select case table_name
+    when 'checkins' then jsonb_build_object(
+      'challenge_id', (
+        select challenge_id from challenge_weeks
+        where id = (r ->> 'challenge_week_id')::integer
+      ),
+      'challenge_week_id', r -> 'challenge_week_id',
+      'challenger_id', r -> 'challenger'
+    )
+    when 'medals' then jsonb_build_object(
+      'challenge_id', r -> 'challenge_id',
+      'challenge_week_id', r -> 'challenge_week_id',
+      'challenger_id', r -> 'challenger_id'
+    )
+    when 'challenger_challenges' then jsonb_build_object(
+      'challenge_id', r -> 'challenge_id',
+      'challenger_id', r -> 'challenger_id'
+    )
+    when 'challengers' then jsonb_build_object('challenger_id', r -> 'id')
+    when 'challenges' then jsonb_build_object('challenge_id', r -> 'id')
+    else jsonb_build_object(
+      'challenge_id', r -> 'challenge_id',
+      'challenge_week_id', r -> 'id'
+    )
+  end;
+$$;
+
+-- Runs once per statement so a statement touching many rows bumps each
+-- scope once, not once per row.
+create or replace function notify_data_change() returns trigger
+language plpgsql as $$
+declare
+  changed jsonb;
+  payloads jsonb[];
+  payload jsonb;
+  versions jsonb := '{}';
+  scope text;
+  newest timestamptz;
+begin
+  -- rows as jsonb so one function serves tables with different columns,
+  -- each trigger only has the transition tables of its own event
+  if tg_op = 'INSERT' then
+    select jsonb_agg(to_jsonb(n)) into changed from new_rows n;
+  elsif tg_op = 'DELETE' then
+    select jsonb_agg(to_jsonb(o)) into changed from old_rows o;
+  else
+    select jsonb_agg(r) into changed from (
+      select to_jsonb(o) as r from old_rows o
+      union all
+      select to_jsonb(n) from new_rows n
+    ) both_sides;
+  end if;
+  if changed is null then
+    return null;
+  end if;
+
+  -- an update that didn't move a row between scopes counts once
+  select array_agg(distinct data_change_payload(tg_table_name, r)) into payloads
+  from jsonb_array_elements(changed) r;
+
+  -- in scope order so concurrent statements lock data_versions rows alike
+  for scope in
+    select 'challenge:' || (p ->> 'challenge_id') from unnest(payloads) p
+    where p ->> 'challenge_id' is not null
+    union
+    select 'week:' || (p ->> 'challenge_week_id') from unnest(payloads) p
+    where p ->> 'challenge_week_id' is not null
+    union
+    select 'challenges' where tg_table_name in ('challenges', 'challenge_weeks')
+    order by 1
+  loop
+    versions := versions || jsonb_build_object(scope, bump_data_version(scope));
+  end loop;
+
+  if tg_table_name = 'checkins' then
+    for scope, newest in
+      select 'checkins:' || cw.challenge_id, max((r ->> 'time')::timestamptz)
+      from jsonb_array_elements(changed) r
+      join challenge_weeks cw on cw.id = (r ->> 'challenge_week_id')::integer
+      group by cw.challenge_id
+      order by 1
+    loop
+      -- as of the newest check-in, a delete leaves it where it was
+      versions := versions || jsonb_build_object(
+        scope, bump_data_version(scope, newest)
+      );
+    end loop;
+  end if;
+
+  foreach payload in array payloads loop
+    perform pg_notify(
+      'data_changed',
+      (payload || jsonb_build_object(
+        'table', tg_table_name,
+        -- only the payload's own scopes, a notification is capped at 8000 bytes
+        'versions', (
+          select coalesce(jsonb_object_agg(key, value), '{}')
+          from jsonb_each(versions)
+          where key in (
+            'challenge:' || (payload ->> 'challenge_id'),
+            'week:' || (payload ->> 'challenge_week_id'),
+            'checkins:' || (payload ->> 'challenge_id'),
+            'challenges'
+          )
+        )
+      ))::text
+    );
+  end loop;
+  return null;
+end;
+$$;
+
+-- Transition tables take one trigger per event.
+do $$
+declare
+  t text;
+begin
+  foreach t in array array[
+    'checkins', 'medals', 'challenger_challenges',
+    'challenge_weeks', 'challenges', 'challengers'
+  ] loop
+    -- the row level trigger this replaced
+    execute format('drop trigger if exists %I on %I', t || '_notify_data_change', t);
+    execute format(
+      'create or replace trigger %I after insert on %I '
+      'referencing new table as new_rows '
+      'for each statement execute function notify_data_change()',
+      t || '_insert_notify_data_change', t
+    );
+    execute format(
+      'create or replace trigger %I after update on %I '
+      'referencing old table as old_rows new table as new_rows '
+      'for each statement execute function notify_data_change()',
+      t || '_update_notify_data_change', t
+    );
+    execute format(
+      'create or replace trigger %I after delete on %I '
+      'referencing old table as old_rows '
+      'for each statement execute function notify_data_change()',
+      t || '_delete_notify_data_change', t
+    );
+  end loop;
+end;
+$$;
@@ -0,0 +1,55 @@
+-- Monotonic version per scope ('challenge:23', 'week:412', 'challenges',
+-- 'checkins:23'), bumped by notify_data_change() in change_feed.sql once
+-- per statement that changes rows in that scope. Load this file before
+-- change_feed.sql.
+--
+-- A checkins scope only moves with the challenge's check-ins and its
+-- updated_at is the newest check-in time, what the index page shows as
+-- the latest check-in; the other scopes' updated_at is when they last
+-- changed.
+create table if not exists data_versions (
+  scope text primary key,
+  version bigint not null,
+  updated_at timestamptz not null default now()
+);
+
+-- as_of replaced a one argument version, drop it so calls aren't ambiguous
+drop function if exists bump_data_version(text);
+
+create or replace function bump_data_version(
+  scope_input text, as_of timestamptz default null
+) returns jsonb
+language sql as $$
+  insert into data_versions as dv (scope, version, updated_at)
+  values (scope_input, 1, coalesce(as_of, clock_timestamp()))
+  on conflict (scope) do update
+    set version = dv.version + 1,
+        updated_at = greatest(dv.updated_at, coalesce(as_of, clock_timestamp()))
+  returning jsonb_build_array(dv.version, dv.updated_at);
+$$;
+
+-- Starting point for existing data, as of the newest check-in.
+insert into data_versions (scope, version, updated_at)
+select 'challenge:' || cw.challenge_id, 1, coalesce(max(c.time), now())
+from challenge_weeks cw
+left join checkins c on c.challenge_week_id = cw.id
+group by cw.challenge_id
+on conflict (scope) do nothing;
+
+insert into data_versions (scope, version, updated_at)
+select 'week:' || cw.id, 1, coalesce(max(c.time), now())
+from challenge_weeks cw
+left join checkins c on c.challenge_week_id = cw.id
+group by cw.id
+on conflict (scope) do nothing;
+
+insert into data_versions (scope, version, updated_at)
+select 'checkins:' || cw.challenge_id, 1, max(c.time)
+from challenge_weeks cw
+join checkins c on c.challenge_week_id = cw.id
+group by cw.challenge_id
+on conflict (scope) do nothing;
+
+insert into data_versions (scope, version, updated_at)
+values ('challenges', 1, now())
+on conflict (scope) do nothing;
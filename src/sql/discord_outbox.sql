@@ -0,0 +1,26 @@
+-- Messages waiting to go out to Discord. Jobs write rows here in the same
+-- transaction as the change they announce, and the bot, which already
+-- holds the Discord session, sends them.
+create table if not exists discord_outbox (
+  id bigserial primary key,
+  channel_id bigint not null,
+  content text,
+  -- Discord embed payload
+  embed jsonb,
+  -- message to reply to, and the reactions to put on it first
+  reply_to bigint,
+  reactions text[] not null default '{}',
+  created_at timestamptz not null default now(),
+  sent_at timestamptz,
+  -- failed sends back off before the next try
+  attempts int not null default 0,
+  next_attempt_at timestamptz not null default now(),
+  last_error text,
+  -- set once the row has failed outbox.MAX_ATTEMPTS times, it's not retried
+  failed_at timestamptz,
+  -- pieces of a split message already out, skipped on the next try
+  delivered_chunks int[] not null default '{}'
+);
+
+create index if not exists discord_outbox_due
+  on discord_outbox (next_attempt_at, id) where sent_at is null and failed_at is null;
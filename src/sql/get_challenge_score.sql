@@ -22,19 +22,45 @@ BEGIN
          FROM
             (
                SELECT
-                  date_part('week', c.time at time zone 'America/New_York') as week,
-                  c.name,
+                  date_part('week', d.day) as week,
+                  d.name,
                   cc.tier as tier,
-                  COUNT(distinct date_part('day', c.time at time zone 'America/New_York')) as count 
+                  COUNT(distinct date_part('day', d.day)) as count 
                FROM
-                  checkins c 
-                  join
-                     challenge_weeks cw 
-                     on c.challenge_week_id = cw.id 
-                     and cw.challenge_id = challenge_id_input 
+                  (
+                     -- open weeks come straight from checkins
+                     SELECT
+                        (c.time at time zone 'America/New_York')::date as day,
+                        c.name,
+                        c.challenger as challenger_id
+                     FROM
+                        checkins c 
+                        join
+                           challenge_weeks cw 
+                           on c.challenge_week_id = cw.id 
+                           and cw.challenge_id = challenge_id_input 
+                     WHERE
+                        not exists (
+                           select 1 from week_snapshots ws
+                           where ws.challenge_week_id = cw.id
+                        )
+                     UNION ALL
+                     -- closed weeks come from their snapshot
+                     SELECT
+                        unnest(wsc.checkin_dates) as day,
+                        wsc.name,
+                        wsc.challenger_id
+                     FROM
+                        week_snapshot_challengers wsc 
+                        join
+                           week_snapshots ws 
+                           on ws.challenge_week_id = wsc.challenge_week_id 
+                           and ws.challenge_id = challenge_id_input 
+                  )
+                  as d 
                   join
                      challenger_challenges cc 
-                     on c.challenger = cc.challenger_id 
+                     on d.challenger_id = cc.challenger_id 
                      and cc.challenge_id = challenge_id_input 
                WHERE
                   cc.knocked_out = knocked_out_input
@@ -42,11 +68,11 @@ BEGIN
                   and cc.tier != 'T0' 
                GROUP BY
                   week,
-                  c.name,
+                  d.name,
                   cc.tier 
                ORDER BY
                   week DESC,
-                  c.name,
+                  d.name,
                   cc.tier 
             )
             as subq
@@ -0,0 +1,10 @@
+-- Final chart for a challenge week, written once by week_close after the
+-- week has ended. Rows are never updated.
+create table if not exists week_charts (
+  challenge_week_id integer primary key references challenge_weeks (id),
+  svg text not null,
+  png bytea not null,
+  heat_map jsonb not null,
+  latest timestamp,
+  rendered_at timestamptz not null default now()
+);
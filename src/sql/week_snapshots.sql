@@ -0,0 +1,35 @@
+-- Immutable state of a challenge week as of the day it closed. Written once
+-- by week_close; reads for closed weeks use these rows instead of
+-- re-deriving everything from checkins.
+create table if not exists week_snapshots (
+  challenge_week_id integer primary key references challenge_weeks (id),
+  challenge_id integer not null references challenges (id),
+  green boolean,
+  bye_week boolean,
+  -- newest check-in of the week in America/New_York
+  latest timestamp,
+  -- final holders of the week scoped medals
+  medals jsonb not null,
+  closed_at timestamptz not null default now()
+);
+
+create table if not exists week_snapshot_challengers (
+  challenge_week_id integer not null references week_snapshots (challenge_week_id),
+  challenger_id integer not null references challengers (id),
+  name text not null,
+  tag text,
+  -- latest check-in per weekday: [{day_of_week, tier, time, is_mulligan}]
+  days jsonb not null,
+  -- distinct America/New_York dates checked in, feeds get_challenge_score
+  checkin_dates date[] not null,
+  checkin_count integer not null,
+  -- points shown on the weekly chart
+  points double precision not null,
+  -- this week's share of calculate_total_score, null without a scored check-in
+  score double precision,
+  knocked_out boolean not null,
+  mulliganed boolean not null,
+  red_week boolean not null,
+  diamond_week boolean not null,
+  primary key (challenge_week_id, challenger_id)
+);
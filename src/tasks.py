@@ -1,14 +1,17 @@
 from rq import cron
-from helpers import fetchall
-from green import determine_if_green
+from green import decide_green
 from auto_knockout import (
+    alerts_for_weeks,
     build_auto_knockout_daily_message,
-    run_auto_knockout,
-    run_auto_knockout_alerts,
+    knockout_week,
+    reconcile_weeks,
 )
-import discord
-from discord_bot import bot
-import os
+import daily
+import week_close
+import week_snapshot
+import outbox
+import payouts
+import cache
 
 # from mulligan import check_last_week_for_mulligan_necessity, insert_mulligan_for
 import logging
@@ -18,21 +21,6 @@ from functools import reduce
 logging.basicConfig(level="DEBUG")
 from rq import cron
 
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-DISCORD_CHANNEL_ID = os.environ.get("ALLOWED_MESSAGE_CHANNEL_ID")
-
-
-async def get_channel():
-    if bot.user is None:
-        await bot.login(DISCORD_TOKEN)
-    channel = bot.get_channel(DISCORD_CHANNEL_ID)
-    if channel is None:
-        channel = await bot.fetch_channel(DISCORD_CHANNEL_ID)
-        if channel is None:
-            logging.info("Cannot find channel %s", DISCORD_CHANNEL_ID)
-    return channel
-
-
 async def example_task():
     print("-- RUNNING EXAMPLE TASK --")
     await send_bot_message("test")
@@ -52,27 +40,12 @@ yes_gifs = [
 ]
 
 
-async def is_green_week():
-    logging.info("Determining if green")
-    green_week = determine_if_green()
-    channel = await get_channel()
-    if channel is None:
-        logging.warning("Cannot send message channel not found")
-        return
-    if green_week == True:
-        await channel.send(
-            content="@everyone",
-            allowed_mentions=discord.AllowedMentions(everyone=True),
-            embed=discord.Embed(
-                image=random.choice(yes_gifs), description="It's a green week! Don't forget that means you need 5 checkins this week or you're knocked out!"
-            )
-        )
-
-
-cron.register(is_green_week, queue_name="cron", cron="2 14 * * 1")
+# The morning's jobs, in order, as steps of one daily run. They share its
+# connection and calendar snapshot; see daily.py.
 
 
-async def challenge_start_message():
+@daily.step(weekday=0)
+def challenge_start_message(run):
     sql = """
     select 
         ch.discord_id,
@@ -85,7 +58,8 @@ async def challenge_start_message():
     where c.start::DATE = current_date::DATE
     """
 
-    challenge = fetchall(sql)
+    run.cur.execute(sql)
+    challenge = run.cur.fetchall()
     if len(challenge) == 0:
         logging.info("No challenge starts today")
         return
@@ -103,41 +77,88 @@ async def challenge_start_message():
 
 > {challengers}
 """
-    channel = await get_channel()
-    if channel is None:
-        logging.warning("Cannot send message channel not found")
-        return
-    await channel.send(message)
+    outbox.post(message, cur=run.cur)
 
 
-cron.register(challenge_start_message, queue_name="cron", cron="0 14 * * 1")
+@daily.step(weekday=0)
+def is_green_week(run):
+    logging.info("Determining if green")
+    challenge_week = run.challenge_week
+    if challenge_week is None:
+        logging.info("No current challenge week to make green")
+        return
+    green_week, changed = decide_green(run.cur, challenge_week)
+    if changed:
+        # auto_knockout below needs this week's requirement
+        run.replace_week(challenge_week._replace(green=green_week))
+        run.on_commit(cache.invalidate_week, challenge_week)
+    if green_week == True:
+        outbox.post(
+            "@everyone",
+            embed={
+                "type": "rich",
+                "description": "It's a green week! Don't forget that means you need 5 checkins this week or you're knocked out!",
+                "image": {"url": random.choice(yes_gifs)},
+            },
+            cur=run.cur,
+        )
 
 
-async def auto_knockout():
+@daily.step()
+def auto_knockout(run):
     logging.info("Running auto-knockout")
-    # Reconciliation commits first so warnings are computed from
-    # post-reconciliation state (fresh mulligans counted, fresh
-    # knockouts excluded).
-    action_events = run_auto_knockout()
-    warning_events = run_auto_knockout_alerts()
+    current_weeks = [knockout_week(w) for w in run.weeks]
+    # The weeks that ended yesterday catch final-day failures that were
+    # never mathematically doomed mid-week; the current weeks catch
+    # challengers who can no longer meet the requirement. Every running
+    # challenge is checked.
+    action_events = reconcile_weeks(
+        run.cur,
+        run.today,
+        [knockout_week(w) for w in run.previous_weeks] + current_weeks,
+    )
+    # Read after the reconciliation, in its transaction, so warnings skip
+    # the challengers it just knocked out and count its mulligans.
+    warning_events = alerts_for_weeks(run.cur, current_weeks, run.today)
     logging.info(
         "Auto-knockout completed with %s state changes and %s warnings",
         len(action_events),
         len(warning_events),
     )
-
+    # Weeks are closed the morning after they end, after this run, but one
+    # closed already (a rerun, a late close) would hide these changes.
+    previous_weeks = {w.id: w for w in run.previous_weeks}
+    for challenge_week_id in {e.challenge_week_id for e in action_events}:
+        if challenge_week_id in previous_weeks:
+            week_snapshot.reopen_if_closed(run.cur, previous_weeks[challenge_week_id])
     message = build_auto_knockout_daily_message(action_events, warning_events)
-    if message is None:
-        return
+    if message is not None:
+        outbox.post(message, cur=run.cur)
+    for event in action_events:
+        run.on_commit(
+            cache.invalidate,
+            "challenge:%s" % event.challenge_id,
+            "week:%s" % event.challenge_week_id,
+        )
 
-    channel = await get_channel()
-    if channel is None:
-        logging.warning("Cannot send auto-knockout message: channel not found")
-        return
-    await channel.send(message)
+
+def daily_run():
+    daily.run()
+
+
+cron.register(daily_run, queue_name="cron", cron="0 14 * * *")
+
+
+def close_completed_weeks():
+    # Runs after auto_knockout so the stored charts show the final
+    # knocked out state for the week.
+    logging.info("Closing completed weeks")
+    week_close.close_completed_weeks()
+    # A challenge's final week is reconciled by now, as above.
+    payouts.settle_finished()
 
 
-cron.register(auto_knockout, queue_name="cron", cron="5 14 * * *")
+cron.register(close_completed_weeks, queue_name="cron", cron="15 14 * * *")
 
 # def check_mulligans():
 #    logging.info("checking for mulligans")
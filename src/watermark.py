@@ -0,0 +1,118 @@
+import logging
+import threading
+from datetime import datetime
+from typing import NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+import cache
+import change_feed
+from helpers import fetchall, fetchone
+
+# Scopes match the cache tags so a moved watermark names what to invalidate.
+CHALLENGES = "challenges"
+
+
+class Watermark(NamedTuple):
+    version: int
+    updated_at: Optional[datetime]
+
+
+UNKNOWN = Watermark(0, None)
+
+_mirror = {}
+_live = False
+_loaded = False
+_lock = threading.Lock()
+
+
+def challenge_scope(challenge_id):
+    return "challenge:%s" % challenge_id
+
+
+def week_scope(challenge_week_id):
+    return "week:%s" % challenge_week_id
+
+
+def checkins_scope(challenge_id):
+    # not a cache tag, the challenge scope already moves with check-ins
+    return "checkins:%s" % challenge_id
+
+
+def get(scope):
+    """
+    The scope's watermark. Served from memory while the change feed is
+    connected, otherwise read from data_versions.
+    """
+    if _live:
+        return _mirror.get(scope, UNKNOWN)
+    row = fetchone(
+        "select version, updated_at from data_versions where scope = %s", [scope]
+    )
+    return UNKNOWN if row is None else Watermark(row.version, row.updated_at)
+
+
+def challenge(challenge_id):
+    return get(challenge_scope(challenge_id))
+
+
+def week(challenge_week_id):
+    return get(week_scope(challenge_week_id))
+
+
+def challenges():
+    return get(CHALLENGES)
+
+
+def checkins(challenge_id):
+    """
+    Moves with the challenge's check-ins alone, as of the newest one, where
+    challenge() moves with any of its data.
+    """
+    return get(checkins_scope(challenge_id))
+
+
+def latest(challenge_id):
+    """The challenge's newest check-in time, as a New York time."""
+    updated_at = checkins(challenge_id).updated_at
+    if updated_at is None:
+        return None
+    return updated_at.astimezone(ZoneInfo("America/New_York")).replace(tzinfo=None)
+
+
+def observe(scope, version, updated_at):
+    with _lock:
+        current = _mirror.get(scope)
+        if current is None or current.version < version:
+            _mirror[scope] = Watermark(version, updated_at)
+
+
+@change_feed.subscribe
+def on_change(change):
+    for scope, (version, updated_at) in change.versions.items():
+        observe(scope, version, datetime.fromisoformat(updated_at))
+
+
+@change_feed.on_connect
+def reload():
+    global _live, _loaded
+    rows = fetchall("select scope, version, updated_at from data_versions")
+    with _lock:
+        # Anything that moved while we weren't listening was never
+        # invalidated, catch up on it now.
+        moved = [
+            r.scope
+            for r in rows
+            if _loaded and _mirror.get(r.scope, UNKNOWN).version != r.version
+        ]
+        _mirror.clear()
+        _mirror.update({r.scope: Watermark(r.version, r.updated_at) for r in rows})
+        _live = _loaded = True
+    if moved:
+        logging.info("Watermarks moved while disconnected: %s", moved)
+        cache.invalidate(*moved)
+
+
+@change_feed.on_disconnect
+def went_stale():
+    global _live
+    _live = False
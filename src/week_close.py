@@ -0,0 +1,117 @@
+from base_queries import challenge_data, total_possible_checkins_through
+from helpers import fetchall, fetchone, with_psycopg
+from datetime import timedelta
+import logging
+import render_pool
+import week_snapshot
+
+
+def snapshot_cutoff(last_closed, today):
+    """
+    Oldest week end that still gets a snapshot. Snapshots freeze today's
+    knocked out state, so only weeks that ended since the last close run
+    (or yesterday, on the first run) get one; older weeks stay live.
+    """
+    if last_closed is None:
+        return today - timedelta(days=1)
+    return min(last_closed, today) - timedelta(days=1)
+
+
+def weeks_to_close():
+    """[(challenge_week, snapshot)] for every ended week still missing its chart or snapshot."""
+    sql = """
+    select
+        cw.*,
+        ws.challenge_week_id is null as unsnapshotted,
+        wc.challenge_week_id is null as uncharted,
+        (select max((closed_at at time zone 'America/New_York')::date)
+         from week_snapshots) as last_closed,
+        (current_timestamp at time zone 'America/New_York')::date as today
+    from challenge_weeks cw
+    left join week_snapshots ws on ws.challenge_week_id = cw.id
+    left join week_charts wc on wc.challenge_week_id = cw.id
+    where
+        cw."end" < (current_timestamp at time zone 'America/New_York')::date
+        and (ws.challenge_week_id is null or wc.challenge_week_id is null)
+    order by cw."end";
+    """
+    weeks = []
+    for row in fetchall(sql):
+        snapshot = row.unsnapshotted and row.end >= snapshot_cutoff(
+            row.last_closed, row.today
+        )
+        if snapshot or row.uncharted:
+            weeks.append((row, snapshot))
+    return weeks
+
+
+def stored_chart(challenge_week_id):
+    return fetchone(
+        "select svg, latest, rendered_at from week_charts where challenge_week_id = %s",
+        [challenge_week_id],
+    )
+
+
+def chart_rendered_at(challenge_week_id):
+    """When the week's stored chart was drawn, None while there is none."""
+    row = fetchone(
+        "select rendered_at from week_charts where challenge_week_id = %s",
+        [challenge_week_id],
+    )
+    return None if row is None else row.rendered_at
+
+
+def stored_png(challenge_week_id):
+    return fetchone(
+        "select png, rendered_at from week_charts where challenge_week_id = %s",
+        [challenge_week_id],
+    )
+
+
+def close_week(challenge_week, snapshot=True):
+    # chart pulls in svgwrite and the scoring modules, only closing needs them.
+    from chart import heat_map_to_json, week_chart
+
+    # Snapshot first so the stored chart is drawn from the frozen data.
+    if snapshot:
+        week_snapshot.write(challenge_week)
+    challenge = challenge_data(challenge_week.challenge_id)
+    chart = week_chart(
+        challenge,
+        challenge_week,
+        challenge_week.id,
+        possible_checkins_so_far=total_possible_checkins_through(
+            challenge.id, challenge_week.id
+        ),
+    )
+    # Already running in a background job, no need to hand off to the pool.
+    png = render_pool.svg_to_png(chart.svg)
+
+    def fn(conn, cur):
+        cur.execute(
+            """
+            insert into week_charts (challenge_week_id, svg, png, heat_map, latest)
+            values (%s, %s, %s, %s, %s)
+            on conflict (challenge_week_id) do nothing
+            """,
+            [
+                challenge_week.id,
+                chart.svg,
+                png,
+                heat_map_to_json(chart.heat_map),
+                chart.latest,
+            ],
+        )
+
+    with_psycopg(fn)
+    logging.info("Closed challenge week %s", challenge_week.id)
+
+
+def close_completed_weeks():
+    weeks = weeks_to_close()
+    logging.info("Closing %s completed weeks", len(weeks))
+    for challenge_week, snapshot in weeks:
+        try:
+            close_week(challenge_week, snapshot)
+        except Exception:
+            logging.exception("Failed to close challenge week %s", challenge_week.id)
@@ -0,0 +1,251 @@
+from base_queries import challenge_data, checkins_this_week
+from datetime import datetime
+from helpers import fetchall, fetchone, with_psycopg
+from types import SimpleNamespace
+from typing import List, NamedTuple
+from zoneinfo import ZoneInfo
+import cache
+import json
+import logging
+import medals
+import payouts
+import rule_sets
+
+# Medals whose holders are settled once the week is over. Challenge wide
+# medals keep moving until the challenge ends so they stay live.
+WEEK_MEDALS = [
+    "highest_tier_week",
+    "earliest_for_week",
+    "latest_for_week",
+    "gold",
+    "green",
+    "red",
+    "diamond",
+    "first_to_green",
+]
+
+
+class Snapshot(NamedTuple):
+    week: object
+    challengers: List[object]
+
+
+def is_closed(challenge_week):
+    return challenge_week.end < datetime.now(tz=ZoneInfo("America/New_York")).date()
+
+
+def load(challenge_week_id):
+    week = fetchone(
+        "select * from week_snapshots where challenge_week_id = %s",
+        [challenge_week_id],
+    )
+    if week is None:
+        return None
+    challengers = fetchall(
+        "select * from week_snapshot_challengers where challenge_week_id = %s order by name",
+        [challenge_week_id],
+    )
+    return Snapshot(week, challengers)
+
+
+def snapshot_checkins(snapshot):
+    """Check-in rows shaped like base_queries.checkins_this_week."""
+    return [
+        SimpleNamespace(
+            name=challenger.name,
+            day_of_week=day["day_of_week"],
+            tier=day["tier"],
+            time=datetime.fromisoformat(day["time"]),
+            bye_week=snapshot.week.bye_week,
+            ismulligan=day["is_mulligan"],
+        )
+        for challenger in snapshot.challengers
+        for day in challenger.days
+    ]
+
+
+def week_points(days, rule_set, bye_week):
+    """Same points the weekly chart shows: best five scored days."""
+    if bye_week:
+        return 0
+    points = [rule_sets.score(day["tier"], rule_set) for day in days if day["tier"]]
+    return sum(sorted(points, reverse=True)[:5])
+
+
+def final_week_medal_holders(challenge_week_id):
+    sql = """
+    WITH ranked_medals AS (
+        SELECT
+            m.*,
+            ROW_NUMBER() OVER (
+                PARTITION BY
+                    m.medal,
+                    CASE
+                        WHEN m.medal IN ('green', 'red', 'diamond', 'gold', 'first_to_green')
+                        THEN m.challenger_id
+                    END
+                ORDER BY m.created_at DESC
+            ) as rn
+        FROM medals m
+        WHERE m.challenge_week_id = %s
+        AND m.medal = ANY(%s)
+    )
+    SELECT
+        rm.medal AS medal_name,
+        rm.emoji AS medal_emoji,
+        rm.challenger_id,
+        rm.checkin_id,
+        ci.tier AS checkin_tier
+    FROM ranked_medals rm
+    LEFT JOIN checkins ci ON ci.id = rm.checkin_id
+    WHERE rm.rn = 1
+    ORDER BY rm.medal;
+    """
+    return fetchall(sql, [challenge_week_id, WEEK_MEDALS])
+
+
+def reopen(cur, challenge_week_id):
+    """
+    Drops a closed week's snapshot and stored chart on cur, and its
+    challenge's settled payouts, for writes landing after the week closed.
+    Reads go back to live data; the close job draws the chart again,
+    snapshots the week again if it's still inside its window and settles
+    the challenge again once it's finished.
+    """
+    for table in ("week_snapshot_challengers", "week_snapshots", "week_charts"):
+        cur.execute(
+            "delete from %s where challenge_week_id = %%s" % table, [challenge_week_id]
+        )
+    payouts.unsettle(cur, challenge_week_id)
+
+
+def reopen_if_closed(cur, challenge_week):
+    """reopen() for a write into challenge_week, when the week is closed."""
+    if is_closed(challenge_week):
+        reopen(cur, challenge_week.id)
+
+
+def write(challenge_week):
+    """Freezes challenge_week. Safe to call again, the first snapshot wins."""
+    challenge = challenge_data(challenge_week.challenge_id)
+    challengers = fetchall(
+        """
+        select
+            ch.id,
+            ch.name,
+            cc.tag,
+            cc.knocked_out,
+            -- as of the week's end: a mulligan spent in a later week doesn't count
+            coalesce(mulligan_week."end" <= %s, false) as mulliganed
+        from challenger_challenges cc
+        join challengers ch on ch.id = cc.challenger_id
+        left join checkins mulligan on mulligan.id = cc.mulligan
+        left join challenge_weeks mulligan_week on mulligan_week.id = mulligan.challenge_week_id
+        where cc.challenge_id = %s
+        """,
+        [challenge_week.end, challenge.id],
+    )
+    checkins = checkins_this_week(challenge_week.id)
+    dates = {
+        row.challenger: row.dates
+        for row in fetchall(
+            """
+            select
+                challenger,
+                array_agg(distinct (time at time zone 'America/New_York')::date) as dates
+            from checkins
+            where challenge_week_id = %s
+            group by challenger
+            """,
+            [challenge_week.id],
+        )
+    }
+    latest = fetchone(
+        """
+        select max(time at time zone 'America/New_York') as latest
+        from checkins where challenge_week_id = %s
+        """,
+        [challenge_week.id],
+    ).latest
+    scores = rule_sets.scores_by_week(challenge.id).get(challenge_week.id, {})
+    red_week = {r.name for r in medals.red(challenge_week.id, execute=True)}
+    diamond_week = {r.name for r in medals.diamond(challenge_week.id, execute=True)}
+    medal_holders = [
+        row._asdict() for row in final_week_medal_holders(challenge_week.id)
+    ]
+
+    rows = []
+    for challenger in challengers:
+        days = [
+            {
+                "day_of_week": c.day_of_week,
+                "tier": c.tier,
+                "time": c.time.isoformat(),
+                "is_mulligan": c.ismulligan,
+            }
+            for c in checkins
+            if c.name == challenger.name
+        ]
+        rows.append(
+            {
+                "challenge_week_id": challenge_week.id,
+                "challenger_id": challenger.id,
+                "name": challenger.name,
+                "tag": challenger.tag,
+                "days": json.dumps(days),
+                "checkin_dates": dates.get(challenger.id, []),
+                "checkin_count": len(days),
+                "points": week_points(days, challenge.rule_set, challenge_week.bye_week),
+                "score": scores.get(challenger.name),
+                "knocked_out": challenger.knocked_out,
+                "mulliganed": challenger.mulliganed,
+                "red_week": challenger.name in red_week,
+                "diamond_week": challenger.name in diamond_week,
+            }
+        )
+
+    def fn(conn, cur):
+        cur.execute(
+            """
+            insert into week_snapshots
+                (challenge_week_id, challenge_id, green, bye_week, latest, medals)
+            values (%s, %s, %s, %s, %s, %s)
+            on conflict (challenge_week_id) do nothing
+            returning challenge_week_id
+            """,
+            [
+                challenge_week.id,
+                challenge.id,
+                challenge_week.green,
+                challenge_week.bye_week,
+                latest,
+                json.dumps(medal_holders),
+            ],
+        )
+        if cur.fetchone() is None:
+            return False
+        cur.executemany(
+            """
+            insert into week_snapshot_challengers
+                (challenge_week_id, challenger_id, name, tag, days, checkin_dates,
+                 checkin_count, points, score, knocked_out, mulliganed, red_week,
+                 diamond_week)
+            values
+                (%(challenge_week_id)s, %(challenger_id)s, %(name)s, %(tag)s,
+                 %(days)s, %(checkin_dates)s, %(checkin_count)s, %(points)s,
+                 %(score)s, %(knocked_out)s, %(mulliganed)s, %(red_week)s,
+                 %(diamond_week)s)
+            """,
+            rows,
+        )
+        return True
+
+    written = with_psycopg(fn)
+    if written:
+        cache.invalidate_week(challenge_week)
+    logging.info(
+        "Snapshot for challenge week %s %s",
+        challenge_week.id,
+        "written" if written else "already existed",
+    )
+    return written
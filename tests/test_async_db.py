@@ -0,0 +1,41 @@
+import asyncio
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+import async_db
+
+
+class AsyncDbTests(unittest.TestCase):
+    def test_loop_keeps_running_while_a_query_blocks(self):
+        release = threading.Event()
+
+        def slow_query():
+            release.wait(5)
+            return "row"
+
+        async def scenario():
+            query = asyncio.ensure_future(async_db.run(slow_query))
+            # Replies and reactions still go out while the query is stuck.
+            await asyncio.sleep(0.01)
+            self.assertFalse(query.done())
+            release.set()
+            return await query
+
+        self.assertEqual(asyncio.run(scenario()), "row")
+
+    def test_errors_reach_the_handler(self):
+        def broken():
+            raise ValueError("bad row")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(async_db.run(broken))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,14 +15,16 @@ sys.path.insert(0, str(REPO_ROOT / "src"))
 from auto_knockout import (
     AutoKnockoutEvent,
     apply_auto_knockout_for_week,
+    apply_auto_knockouts,
     build_auto_knockout_alert_message,
     build_auto_knockout_alerts_for_week,
     build_auto_knockout_daily_message,
     build_auto_knockout_reconciliation_message,
+    decide_auto_knockouts,
     first_missed_day,
     get_alert_participants_for_week,
-    get_participants_for_week,
-    get_previous_challenge_week,
+    get_participants_for_weeks,
+    get_previous_challenge_weeks,
     run_auto_knockout,
     should_send_first_no_slack_warning,
 )
@@ -53,8 +55,10 @@ def participant(
     current_day_checked_in=False,
     mulligan_challenge_week_id=None,
     mulligan_day=None,
+    challenge_week_id=10,
 ):
     return SimpleNamespace(
+        challenge_week_id=challenge_week_id,
         id=challenger_id,
         name=name,
         discord_id=str(1000 + challenger_id),
@@ -75,12 +79,25 @@ class FakeCursor:
 
     def execute(self, sql, params=None):
         self.queries.append((sql, params))
+        self.rows = []
+        if "insert into checkins" in sql:
+            # returning id, challenger, challenge_week_id per mulligan
+            _, _, _, week_ids, challenger_ids, _, _ = params
+            for week_id, challenger_id in zip(week_ids, challenger_ids):
+                self.rows.append(
+                    SimpleNamespace(
+                        id=self.next_checkin_id,
+                        challenger=challenger_id,
+                        challenge_week_id=week_id,
+                    )
+                )
+                self.next_checkin_id += 1
 
     def fetchone(self):
         return SimpleNamespace(id=self.next_checkin_id)
 
     def fetchall(self):
-        return []
+        return self.rows
 
 
 class FakeRunCursor:
@@ -91,11 +108,10 @@ class FakeRunCursor:
     def execute(self, sql, params=None):
         self.queries.append((sql, params))
 
-    def fetchone(self):
-        return self.challenge_week_result
-
     def fetchall(self):
-        raise AssertionError("participants should not be fetched")
+        if "unnest" in self.queries[-1][0]:
+            raise AssertionError("participants should not be fetched")
+        return [self.challenge_week_result]
 
 
 def query_texts(cur):
@@ -131,8 +147,10 @@ class AutoKnockoutTests(unittest.TestCase):
         self.assertEqual(events[0].mulligan_checkin_id, 123)
         self.assertEqual(events[0].mulligan_day, "Tuesday")
         self.assertEqual(events[0].discord_id, "1001")
+        # Insert and pointer update are one statement.
+        self.assertEqual(len(cur.queries), 1)
         self.assertIn("insert into checkins", query_texts(cur)[0])
-        self.assertIn("set mulligan", query_texts(cur)[1])
+        self.assertIn("set mulligan", query_texts(cur)[0])
 
     def test_knockout_set_when_below_requirement_with_existing_mulligan(self):
         cur = FakeCursor()
@@ -333,6 +351,89 @@ class AutoKnockoutTests(unittest.TestCase):
         self.assertEqual(events[0].action, "knockout")
         self.assertIn("set knocked_out = true", query_texts(cur)[0])
 
+    def test_every_challenge_is_applied_in_bulk(self):
+        cur = FakeCursor()
+        other_week = SimpleNamespace(
+            **{**vars(challenge_week()), "challenge_id": 2, "challenge_week_id": 20}
+        )
+
+        events = apply_auto_knockouts(
+            cur,
+            [
+                (
+                    challenge_week(),
+                    [
+                        participant(checkin_count=0, mulligan=99, challenger_id=1),
+                        participant(checkin_count=0, mulligan=99, challenger_id=2),
+                    ],
+                ),
+                (
+                    other_week,
+                    [
+                        participant(
+                            checkin_count=1,
+                            checked_in_days=["Monday"],
+                            challenger_id=3,
+                            challenge_week_id=20,
+                        ),
+                        participant(
+                            checkin_count=0, mulligan=98, challenger_id=4, challenge_week_id=20
+                        ),
+                    ],
+                ),
+            ],
+            WEEK_END_RUN_DATE,
+        )
+
+        self.assertEqual(
+            [(e.action, e.challenge_id, e.challenger_id) for e in events],
+            [("knockout", 1, 1), ("knockout", 1, 2), ("mulligan", 2, 3), ("knockout", 2, 4)],
+        )
+        self.assertEqual(events[2].mulligan_checkin_id, 123)
+        # One mulligan statement, then one knockout statement for everyone.
+        self.assertEqual(len(cur.queries), 2)
+        self.assertIn("insert into checkins", query_texts(cur)[0])
+        self.assertIn("set knocked_out = true", query_texts(cur)[1])
+        self.assertEqual(cur.queries[1][1], ([1, 2, 4], [1, 1, 2]))
+
+    def test_previous_week_decisions_carry_into_the_current_week(self):
+        previous_week = SimpleNamespace(**{**vars(challenge_week()), "challenge_week_id": 9})
+        current_week = SimpleNamespace(
+            **{
+                **vars(challenge_week()),
+                "start": date(2026, 5, 4),
+                "end": date(2026, 5, 10),
+            }
+        )
+        run_date = date(2026, 5, 10)
+
+        decisions = decide_auto_knockouts(
+            [
+                (
+                    previous_week,
+                    [
+                        participant(checkin_count=1, checked_in_days=["Monday"], challenger_id=1),
+                        participant(checkin_count=0, mulligan=99, challenger_id=2),
+                    ],
+                ),
+                (
+                    current_week,
+                    [
+                        participant(checkin_count=0, challenger_id=1),
+                        participant(checkin_count=0, mulligan=99, challenger_id=2),
+                    ],
+                ),
+            ],
+            run_date,
+        )
+
+        # Challenger 1 spent their mulligan last week so is knocked out now;
+        # challenger 2 was already knocked out last week.
+        self.assertEqual(
+            [(action, p.id, w.challenge_week_id) for action, p, w, _, _ in decisions],
+            [("mulligan", 1, 9), ("knockout", 2, 9), ("knockout", 1, 10)],
+        )
+
     def test_first_missed_day_skips_checked_in_days(self):
         day_name, missing_date = first_missed_day(
             date(2026, 4, 27),
@@ -345,9 +446,7 @@ class AutoKnockoutTests(unittest.TestCase):
     def test_participant_query_skips_knocked_out_challengers(self):
         cur = FakeCursor()
 
-        get_participants_for_week(
-            cur, challenge_id=1, challenge_week_id=10, run_day="Saturday"
-        )
+        get_participants_for_weeks(cur, [challenge_week()], run_day="Saturday")
 
         self.assertIn("ch.discord_id", query_texts(cur)[0])
         self.assertIn("cc.knocked_out = false", query_texts(cur)[0])
@@ -355,17 +454,15 @@ class AutoKnockoutTests(unittest.TestCase):
     def test_participant_query_exposes_current_day_checkin(self):
         cur = FakeCursor()
 
-        get_participants_for_week(
-            cur, challenge_id=1, challenge_week_id=10, run_day="Saturday"
-        )
+        get_participants_for_weeks(cur, [challenge_week()], run_day="Saturday")
 
         self.assertIn("current_day_checked_in", query_texts(cur)[0])
-        self.assertEqual(cur.queries[0][1][0], "Saturday")
+        self.assertEqual(cur.queries[0][1], ([1], [10], "Saturday"))
 
     def test_previous_challenge_week_only_targets_week_ending_yesterday(self):
         cur = FakeCursor()
 
-        get_previous_challenge_week(cur)
+        get_previous_challenge_weeks(cur)
 
         self.assertIn('cw."end" = (', query_texts(cur)[0])
         self.assertIn("interval '1 day'", query_texts(cur)[0])
@@ -409,8 +506,10 @@ class AutoKnockoutTests(unittest.TestCase):
 
         # Previous week ended one check-in short: mulligan applies.
         # Current week just started: nobody is doomed yet.
-        previous_participants = [participant(checkin_count=1, checked_in_days=[])]
-        current_participants = [participant(checkin_count=0)]
+        participants = [
+            participant(checkin_count=1, checked_in_days=[], challenge_week_id=9),
+            participant(checkin_count=0, challenge_week_id=10),
+        ]
 
         cur = FakeCursor()
 
@@ -421,16 +520,16 @@ class AutoKnockoutTests(unittest.TestCase):
             sys.modules,
             {"helpers": SimpleNamespace(with_psycopg=fake_with_psycopg)},
         ), patch(
-            "auto_knockout.get_previous_challenge_week", return_value=previous_week
+            "auto_knockout.get_previous_challenge_weeks", return_value=[previous_week]
         ), patch(
-            "auto_knockout.get_current_challenge_week", return_value=current_week
+            "auto_knockout.get_current_challenge_weeks", return_value=[current_week]
         ), patch(
-            "auto_knockout.get_participants_for_week",
-            side_effect=[previous_participants, current_participants],
+            "auto_knockout.get_participants_for_weeks", return_value=participants
         ) as participants_mock:
             events = run_auto_knockout()
 
-        self.assertEqual(participants_mock.call_count, 2)
+        # One participant query covers both weeks.
+        self.assertEqual(participants_mock.call_count, 1)
         self.assertEqual(len(events), 1)
         self.assertEqual(events[0].action, "mulligan")
         self.assertEqual(events[0].challenge_week_id, 9)
@@ -0,0 +1,86 @@
+import pickle
+import sys
+import unittest
+from collections import namedtuple
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from flask import Flask
+
+import cache
+
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        cache.set_backend(cache.MemoryBackend())
+        self.calls = 0
+
+    def tearDown(self):
+        cache.set_backend(None)
+
+    def test_cached_until_tag_is_invalidated(self):
+        @cache.cached("challenge:{challenge_id}")
+        def points(challenge_id):
+            self.calls += 1
+            return [challenge_id, self.calls]
+
+        self.assertEqual(points(23), [23, 1])
+        self.assertEqual(points(23), [23, 1])
+        self.assertEqual(points(challenge_id=24), [24, 2])
+
+        cache.invalidate("challenge:23")
+
+        self.assertEqual(points(23), [23, 3])
+        self.assertEqual(points(24), [24, 2])
+
+    def test_invalidate_week_drops_challenge_entries(self):
+        @cache.cached("challenge:{challenge_id}")
+        def totals(challenge_id):
+            self.calls += 1
+            return self.calls
+
+        totals(23)
+        cache.invalidate_week(namedtuple("Week", "id challenge_id")(412, 23))
+
+        self.assertEqual(totals(23), 2)
+
+    def test_rows_survive_pickling(self):
+        row = psycopg_row(["name", "tier"], ["Tom", "T3"])
+
+        frozen = pickle.loads(pickle.dumps(cache.freeze([row])))[0]
+
+        self.assertEqual(frozen.name, "Tom")
+        self.assertEqual(frozen[1], "T3")
+        self.assertEqual(frozen._asdict(), {"name": "Tom", "tier": "T3"})
+
+    def test_cached_view(self):
+        app = Flask(__name__)
+
+        @app.route("/page")
+        @cache.cached_view(lambda: ["challenge:23"])
+        def page():
+            self.calls += 1
+            return "render %s" % self.calls
+
+        client = app.test_client()
+        self.assertEqual(client.get("/page").text, "render 1")
+        self.assertEqual(client.get("/page").text, "render 1")
+        self.assertEqual(client.get("/page?week=2").text, "render 2")
+
+        cache.invalidate("challenge:23")
+
+        self.assertEqual(client.get("/page").text, "render 3")
+
+
+def psycopg_row(names, values):
+    """A row as psycopg's namedtuple_row builds it, with a generated class."""
+    from psycopg.rows import _make_nt
+
+    return _make_nt("utf-8", *[n.encode() for n in names])(*values)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+from werkzeug.http import http_date
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from flask import Flask
+
+from cache_decorator import conditional, validator
+
+
+LAST_MODIFIED = datetime(2026, 3, 2, 14, 30, 15, 250000, tzinfo=timezone.utc)
+
+
+class ConditionalTests(unittest.TestCase):
+    def setUp(self):
+        self.renders = 0
+        app = Flask(__name__)
+
+        @app.route("/page", methods=["GET", "POST"])
+        @conditional(lambda: validator("state", last_modified=LAST_MODIFIED))
+        def page():
+            self.renders += 1
+            return "page"
+
+        self.client = app.test_client()
+
+    def test_first_request_gets_validators(self):
+        response = self.client.get("/page")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Last-Modified"], http_date(LAST_MODIFIED))
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        self.assertIsNotNone(response.get_etag()[0])
+        self.assertEqual(self.renders, 1)
+
+    def test_matching_etag_skips_render(self):
+        etag = self.client.get("/page").get_etag()[0]
+
+        response = self.client.get("/page", headers={"If-None-Match": '"%s"' % etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.renders, 1)
+
+    def test_stale_etag_wins_over_if_modified_since(self):
+        response = self.client.get(
+            "/page",
+            headers={
+                "If-None-Match": '"other"',
+                "If-Modified-Since": http_date(LAST_MODIFIED),
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        fresh = self.client.get(
+            "/page", headers={"If-Modified-Since": http_date(LAST_MODIFIED)}
+        )
+        stale = self.client.get(
+            "/page",
+            headers={"If-Modified-Since": http_date(LAST_MODIFIED.replace(minute=0))},
+        )
+
+        self.assertEqual(fresh.status_code, 304)
+        self.assertEqual(stale.status_code, 200)
+
+    def test_post_is_never_short_circuited(self):
+        etag = self.client.get("/page").get_etag()[0]
+
+        response = self.client.post("/page", headers={"If-None-Match": '"%s"' % etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
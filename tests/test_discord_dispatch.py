@@ -0,0 +1,127 @@
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+import discord_dispatch
+
+
+class FakeDiscordHttp:
+    """
+    Stands in for Discord: records each call with its time, takes `latency`
+    per round trip and answers 429 to the first `rate_limited` calls.
+    """
+
+    def __init__(self, latency=0.02, rate_limited=0):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.calls = []
+
+    async def record(self, call):
+        await asyncio.sleep(self.latency)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise discord_dispatch.RateLimited(0.01)
+        self.calls.append((time.monotonic(), call))
+
+    async def add_reaction(self, channel_id, message_id, emoji):
+        await self.record(("react", channel_id, message_id, emoji))
+
+    async def send_message(self, channel_id, content, reply_to=None, embed=None):
+        await self.record(("send", channel_id, reply_to, content))
+
+
+# Loose enough that pacing doesn't slow the suite down.
+FAST_LIMITS = {"reaction": (2, 0.05), "message": (5, 0.05)}
+
+
+@mock.patch.dict(discord_dispatch.ROUTE_LIMITS, FAST_LIMITS)
+class DispatcherTests(unittest.TestCase):
+    def run_dispatch(self, http, fn):
+        async def scenario():
+            dispatcher = discord_dispatch.Dispatcher(http)
+            fn(dispatcher)
+            await dispatcher.drain()
+
+        asyncio.run(scenario())
+        return [call for _, call in http.calls]
+
+    def test_each_message_keeps_its_order(self):
+        http = FakeDiscordHttp()
+
+        calls = self.run_dispatch(
+            http,
+            lambda d: [
+                d.react(1, 10, ["✅", "🔥", "🥇"]),
+                d.reply(1, 10, "medals"),
+                d.react(2, 20, ["✅"]),
+            ],
+        )
+
+        first = [c for c in calls if c[2] == 10]
+        self.assertEqual(
+            first,
+            [
+                ("react", 1, 10, "✅"),
+                ("react", 1, 10, "🔥"),
+                ("react", 1, 10, "🥇"),
+                ("send", 1, 10, "medals"),
+            ],
+        )
+        self.assertIn(("react", 2, 20, "✅"), calls)
+
+    def test_messages_go_out_concurrently(self):
+        http = FakeDiscordHttp(latency=0.05)
+        started = time.monotonic()
+
+        self.run_dispatch(
+            http, lambda d: [d.react(channel, 1, ["✅"]) for channel in range(8)]
+        )
+
+        # One after another would take 8 round trips.
+        self.assertLess(time.monotonic() - started, 0.05 * 4)
+
+    def test_bucket_paces_a_channel(self):
+        http = FakeDiscordHttp(latency=0)
+
+        self.run_dispatch(http, lambda d: d.react(1, 10, ["a", "b", "c", "d", "e"]))
+
+        times = [t for t, _ in http.calls]
+        # Two per 50ms: the fifth can't go before two windows have passed.
+        self.assertGreaterEqual(times[-1] - times[0], 0.09)
+
+    def test_rate_limited_calls_are_retried(self):
+        http = FakeDiscordHttp(rate_limited=1)
+
+        with self.assertLogs(level="WARNING"):
+            calls = self.run_dispatch(http, lambda d: d.send(1, "hello"))
+
+        self.assertEqual(calls, [("send", 1, None, "hello")])
+
+    def test_failures_do_not_stop_the_rest(self):
+        http = FakeDiscordHttp()
+        original = http.add_reaction
+
+        async def add_reaction(channel_id, message_id, emoji):
+            if emoji == "bad":
+                raise RuntimeError("unknown emoji")
+            await original(channel_id, message_id, emoji)
+
+        http.add_reaction = add_reaction
+
+        with self.assertLogs(level="ERROR"):
+            calls = self.run_dispatch(
+                http, lambda d: [d.react(1, 10, ["bad", "✅"]), d.reply(1, 10, "hi")]
+            )
+
+        self.assertEqual(calls, [("react", 1, 10, "✅"), ("send", 1, 10, "hi")])
+
+
+if __name__ == "__main__":
+    unittest.main()
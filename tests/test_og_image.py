@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+import og_image
+
+
+class CountingRenderer:
+    def __init__(self, delay=0):
+        self.calls = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, svg):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return ("png:" + svg).encode("utf-8")
+
+
+class OgImageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_svg_is_rendered_once(self):
+        render = CountingRenderer()
+
+        first = og_image.ensure_png("<svg/>", self.directory, 10_000, render)
+        second = og_image.ensure_png("<svg/>", self.directory, 10_000, render)
+
+        self.assertEqual(first, second)
+        self.assertEqual(render.calls, 1)
+        with open(os.path.join(self.directory, first + ".png"), "rb") as f:
+            self.assertEqual(f.read(), b"png:<svg/>")
+
+    def test_changed_svg_gets_new_digest(self):
+        render = CountingRenderer()
+
+        first = og_image.ensure_png("<svg>1</svg>", self.directory, 10_000, render)
+        second = og_image.ensure_png("<svg>2</svg>", self.directory, 10_000, render)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(render.calls, 2)
+        self.assertEqual(og_image.static_filename(first), "og/%s.png" % first)
+
+    def test_concurrent_requests_render_once(self):
+        render = CountingRenderer(delay=0.05)
+        threads = [
+            threading.Thread(
+                target=og_image.ensure_png,
+                args=("<svg/>", self.directory, 10_000, render),
+            )
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(render.calls, 1)
+        leftovers = [n for n in os.listdir(self.directory) if n.startswith(".tmp-")]
+        self.assertEqual(leftovers, [])
+
+    def test_least_recently_used_images_are_evicted(self):
+        render = CountingRenderer()
+        oldest = og_image.ensure_png("<svg>a</svg>", self.directory, 10_000, render)
+        middle = og_image.ensure_png("<svg>b</svg>", self.directory, 10_000, render)
+        os.utime(os.path.join(self.directory, oldest + ".png"), (1, 1))
+        os.utime(os.path.join(self.directory, middle + ".png"), (2, 2))
+
+        # Each file is 16 bytes, so a 40 byte budget only fits two of them.
+        newest = og_image.ensure_png("<svg>c</svg>", self.directory, 40, render)
+
+        remaining = sorted(n for n in os.listdir(self.directory) if n.endswith(".png"))
+        self.assertEqual(remaining, sorted([middle + ".png", newest + ".png"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from flask import Flask
+
+import cache
+import single_flight
+
+
+class SingleFlightTests(unittest.TestCase):
+    def setUp(self):
+        self.store = cache.MemoryBackend()
+        cache.set_backend(self.store)
+        self.calls = 0
+
+    def tearDown(self):
+        cache.set_backend(None)
+
+    def build(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return "chart"
+
+    def lock(self, key):
+        return self.store.get_many([single_flight.LOCK_PREFIX + key])[0]
+
+    def test_concurrent_builds_share_the_leaders_result(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(single_flight.run("week:412", self.build))
+            )
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ["chart"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(self.lock("week:412"))
+
+    def test_unshared_results_are_rebuilt(self):
+        single_flight.run("week:412", lambda: None)
+
+        self.assertEqual(single_flight.run("week:412", self.build), "chart")
+        self.assertEqual(self.calls, 1)
+
+    def test_followers_build_themselves_once_a_dead_leader_times_out(self):
+        # A leader that died holding the lock never shares a result.
+        self.store.add(single_flight.LOCK_PREFIX + "week:412", b"dead", 30)
+
+        with mock.patch.object(single_flight, "LOCK_SECONDS", 0.1), self.assertLogs(
+            level="WARNING"
+        ):
+            self.assertEqual(single_flight.run("week:412", self.build), "chart")
+
+        self.assertEqual(self.calls, 1)
+
+    def test_a_failed_build_releases_the_lock(self):
+        def fails():
+            raise RuntimeError("db down")
+
+        with self.assertRaises(RuntimeError):
+            single_flight.run("week:412", fails)
+
+        self.assertIsNone(self.lock("week:412"))
+        self.assertEqual(single_flight.run("week:412", self.build), "chart")
+
+    def test_only_the_lock_owner_releases_it(self):
+        def outlives_its_lock():
+            # The lock lapsed mid-build and another leader took it.
+            self.store.set(single_flight.LOCK_PREFIX + "week:412", b"next", 30)
+            return "chart"
+
+        single_flight.run("week:412", outlives_its_lock)
+
+        self.assertEqual(self.lock("week:412"), b"next")
+
+    def test_an_unavailable_store_just_builds(self):
+        broken = mock.Mock(get_many=mock.Mock(side_effect=ConnectionError("valkey down")))
+        cache.set_backend(broken)
+
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(single_flight.run("week:412", self.build), "chart")
+
+
+class CoalesceTests(unittest.TestCase):
+    def setUp(self):
+        cache.set_backend(cache.MemoryBackend())
+        self.renders = 0
+        app = Flask(__name__)
+
+        @app.route("/chart")
+        @single_flight.coalesce(lambda: "v1")
+        def chart():
+            self.renders += 1
+            return "render %s" % self.renders
+
+        @app.route("/missing")
+        @single_flight.coalesce(lambda: "v1")
+        def missing():
+            self.renders += 1
+            return "gone", 404
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        cache.set_backend(None)
+
+    def test_identical_builds_share_the_response(self):
+        first = self.client.get("/chart")
+        second = self.client.get("/chart")
+
+        self.assertEqual(first.get_data(as_text=True), "render 1")
+        self.assertEqual(second.get_data(as_text=True), "render 1")
+
+    def test_errors_are_not_shared(self):
+        self.client.get("/missing")
+        response = self.client.get("/missing")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.renders, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()